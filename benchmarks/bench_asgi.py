@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import wsgiref.simple_server
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+
+
+PROGRAM_EVERY = 5  # One client in five posts programs; the rest load slots
+
+
+class PooledWSGIServer(wsgiref.simple_server.WSGIServer):
+    # Stands in for uwsgi.ini: one process, three request threads
+    request_queue_size = 100  # uwsgi's default listen backlog
+
+    def __init__(self, address, handler, threads=3):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_wsgi(host_socket, slots):
+    import server
+    from host import HostConnection
+
+    app = server.create_app(host=HostConnection(host_socket), slots=slots)
+    httpd = PooledWSGIServer(('127.0.0.1', free_port()), QuietHandler)
+    httpd.set_app(app)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd.server_address[1], httpd.shutdown
+
+
+def start_asgi(host_socket, slots):
+    import uvicorn
+    import server_asgi
+    from asynchost import AsyncHostConnection
+
+    app = server_asgi.create_app(host=AsyncHostConnection(host_socket), slots=slots)
+    port = free_port()
+    config = uvicorn.Config(app, host='127.0.0.1', port=port, lifespan='off', log_level='warning', access_log=False)
+    uvicorn_server = uvicorn.Server(config)
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    while not uvicorn_server.started:
+        time.sleep(0.01)
+
+    def stop():
+        uvicorn_server.should_exit = True
+        thread.join()
+    return port, stop
+
+
+async def fetch(port, method, path, body=b''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(('%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                  'Content-Length: %d\r\nConnection: close\r\n\r\n' % (method, path, len(body))).encode() + body)
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b' ', 2)[1])
+    if status != 200:
+        raise RuntimeError('%s %s: HTTP %d' % (method, path, status))
+
+
+async def client(port, number, deadline, latencies):
+    program = number % PROGRAM_EVERY == 0
+    body = json.dumps({'program': "robot.say('hi')\n", 'dry_run': True}).encode()
+    kind = 'program' if program else 'slots'
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if program:
+            await fetch(port, 'POST', '/api/program', body)
+        else:
+            await fetch(port, 'GET', '/api/slots')
+        latencies[kind].append(time.perf_counter() - start)
+
+
+async def load(port, clients, duration):
+    latencies = {'program': [], 'slots': []}
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[client(port, n, deadline, latencies) for n in range(clients)])
+    requests = sum(len(samples) for samples in latencies.values())
+    return {
+        'requests_per_s': requests / duration,
+        'p99_s': common.percentile(latencies['program'] + latencies['slots'], 99),
+        'program_s': common.summarize(latencies['program']),
+        'slots_s': common.summarize(latencies['slots']),
+    }
+
+
+def bench(start, clients, duration):
+    from slots import SlotStore
+
+    # The real host on simulated hardware, so program requests cost a sandbox build
+    with common.SimulatedHost() as host:
+        port, stop = start(host.socket, SlotStore(os.path.join(host.data_dir, 'slots')))
+        try:
+            return asyncio.run(load(port, clients, duration))
+        finally:
+            stop()
+
+
+def run(clients=(50, 100), duration=5.0):
+    results = {}
+    for count in clients:
+        results[str(count)] = {
+            'wsgi': bench(start_wsgi, count, duration),
+            'asgi': bench(start_asgi, count, duration),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    for clients, result in run().items():
+        for kind in ('wsgi', 'asgi'):
+            r = result[kind]
+            print('%3s clients %s: %7.1f req/s, p99 %.3fs (slots p99 %.3fs, program p99 %.3fs)' % (
+                clients, kind, r['requests_per_s'], r['p99_s'], r['slots_s']['p99'], r['program_s']['p99']))
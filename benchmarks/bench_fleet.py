@@ -0,0 +1,86 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import common
+from fleet import Fleet
+from host import HostConnection, HostError
+
+
+PROGRAM = "robot.roll('forward', 0.01)\n"
+TOKEN = 'bench-fleet'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_hosts(count, directory):
+    # Separate robot.py processes on simulated hardware, reached over TCP as a fleet would be
+    processes, hosts = [], {}
+    for i in range(count):
+        data_dir = os.path.join(directory, 'robot%d' % i)
+        port = free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, 'robot.py', '--simulate', '--data', data_dir,
+             '--socket', os.path.join(data_dir, 'control'), '--tcp', '127.0.0.1:%d' % port],
+            cwd=os.path.join(common.ROOT, 'host'), env=dict(os.environ, ROBOT_TOKEN=TOKEN),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        hosts['robot%d' % i] = HostConnection(('127.0.0.1', port), timeout=30, token=TOKEN)
+    for host in hosts.values():
+        wait_until_up(host)
+    return processes, Fleet(hosts)
+
+
+def wait_until_up(host, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            host.request('STATS')
+            return
+        except HostError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def bench(count, iterations):
+    directory = tempfile.mkdtemp(prefix='robot-fleet-')
+    processes, fleet = start_hosts(count, directory)
+    try:
+        names = fleet.names()
+        fleet.run(names, PROGRAM)  # Warm the sandboxes and program caches
+        stops, runs = [], []
+        for i in range(iterations):
+            start = time.perf_counter()
+            results = fleet.stop(names)
+            stops.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            results.update(fleet.run(names, PROGRAM))
+            runs.append(time.perf_counter() - start)
+            assert all(result['status'] == 'OK' for result in results.values()), results
+        return {'robots': count, 'stop_s': common.summarize(stops), 'run_s': common.summarize(runs)}
+    finally:
+        fleet.close()
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run(sizes=(1, 2, 4, 8), iterations=30):
+    return {str(count): bench(count, iterations) for count in sizes}
+
+
+if __name__ == '__main__':
+    for result in run().values():
+        print('%2d robots: STOP p50 %.2fms p99 %.2fms, RUN p50 %.2fms p99 %.2fms' % (
+            result['robots'],
+            result['stop_s']['p50'] * 1000, result['stop_s']['p99'] * 1000,
+            result['run_s']['p50'] * 1000, result['run_s']['p99'] * 1000))
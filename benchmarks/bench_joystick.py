@@ -0,0 +1,63 @@
+import os
+import struct
+import time
+
+import common
+from control import Controls, Joystick
+from hardware import SIMULATED_AXES, SIMULATED_BUTTONS
+
+
+class CountingLoop:
+    def __init__(self):
+        self.scheduled = 0
+
+    def time(self):
+        return time.monotonic()
+
+    def call_soon(self, callback, *args):
+        self.scheduled += 1
+
+
+def run_controllers(count, events, batch):
+    # The same event volume spread over `count` controllers feeding one Controls
+    controls = Controls()
+    controls.add_axis_callback('x', None)
+    controls.add_axis_callback('y', None)
+    loop = CountingLoop()
+    devices = []
+    for _ in range(count):
+        read_fd, write_fd = os.pipe()
+        joystick = Joystick(os.fdopen(read_fd, 'rb', buffering=0), controls=controls,
+                            axes=SIMULATED_AXES, buttons=SIMULATED_BUTTONS, name='Benchmark joystick')
+        joystick.loop = loop
+        devices.append((joystick, write_fd))
+
+    # A stick sweep: alternating x/y axis events with changing values
+    payload = b''.join(struct.pack('IhBB', i, (i * 997) % 65535 - 32767, 0x02, i % 2) for i in range(batch))
+    rounds = events // batch
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        joystick, write_fd = devices[i % count]
+        os.write(write_fd, payload)
+        joystick.get_input()
+    elapsed = time.perf_counter() - start
+
+    for joystick, write_fd in devices:
+        os.close(write_fd)
+        joystick.dev.close()
+    return {
+        'events': controls.events,
+        'events_per_s': controls.events / elapsed,
+        'reads': controls.reads,
+        'callbacks_scheduled': loop.scheduled,
+    }
+
+
+def run(events=200000, batch=64, controllers=(1, 4)):
+    return {str(count): run_controllers(count, events, batch) for count in controllers}
+
+
+if __name__ == '__main__':
+    for count, result in run().items():
+        print('%s controller(s): %s' % (count, result))
@@ -0,0 +1,46 @@
+import os
+import time
+
+import common
+
+
+PROGRAM = "robot.roll('forward', 0.01)\n"
+
+
+def wait_for_pwm(backend, mark, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for entry in backend.log[mark:]:
+            if entry[1] == 'pwm':
+                return backend.start + entry[0]
+        time.sleep(0.0002)
+    raise TimeoutError('No action reached the hardware')
+
+
+def run(iterations=50):
+    import falcon.testing
+    import server
+    from host import HostConnection
+    from slots import SlotStore
+
+    with common.SimulatedHost() as sim:
+        host = HostConnection(sim.socket)
+        app = server.create_app(host=host, slots=SlotStore(os.path.join(sim.data_dir, 'slots')))
+        client = falcon.testing.TestClient(app)
+
+        accepted, first_action = [], []
+        for i in range(iterations):
+            mark = len(sim.backend.log)
+            start = time.monotonic()
+            result = client.simulate_post('/api/program', json={'program': PROGRAM})
+            assert result.status_code == 200, result.text
+            accepted.append(time.monotonic() - start)
+            first_action.append(wait_for_pwm(sim.backend, mark) - start)
+            time.sleep(0.03)
+        host.close()
+
+    return {'accepted_s': common.summarize(accepted), 'first_action_s': common.summarize(first_action)}
+
+
+if __name__ == '__main__':
+    print(run())
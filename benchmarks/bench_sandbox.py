@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import common
+from host import HostConnection
+from routine import Routine
+
+
+# Builds in about a second of CPU, well inside the sandbox's limit
+HEAVY_PROGRAM = '''
+total = 0
+for i in range(3000000):
+    total = total + i % 7
+robot.roll('forward', 0.1)
+'''
+
+PERIOD = 0.02  # Drive's 50 Hz control rate
+
+
+async def probe(stop):
+    # Stands in for the drive loop: how late does each 20 ms deadline fire?
+    loop = asyncio.get_running_loop()
+    lateness = []
+    deadline = loop.time()
+    while not stop.is_set():
+        deadline += PERIOD
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+        lateness.append(loop.time() - deadline)
+        deadline = max(deadline, loop.time())
+    return lateness
+
+
+async def in_process(robot):
+    # What handle_RUN did before the sandbox: exec on the event loop
+    stop = asyncio.Event()
+    task = asyncio.ensure_future(probe(stop))
+    await asyncio.sleep(0.1)
+    exec(compile(HEAVY_PROGRAM, '<program>', 'exec'), {'robot': Routine(robot)})
+    await asyncio.sleep(0.1)
+    stop.set()
+    return await task
+
+
+def sandboxed(host):
+    client = HostConnection(host.socket, timeout=30)
+    stop = asyncio.Event()
+    task = asyncio.run_coroutine_threadsafe(probe(stop), host.loop)
+    time.sleep(0.1)
+    start = time.perf_counter()
+    result = client.request('RUN', program=HEAVY_PROGRAM, dry_run=True)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.1)
+    host.loop.call_soon_threadsafe(stop.set)
+    client.close()
+    assert result['status'] == 'OK', result
+    return task.result(), elapsed
+
+
+def run():
+    with common.SimulatedHost() as host:
+        baseline = host.call(in_process(host.robot))
+        lateness, elapsed = sandboxed(host)
+    return {
+        'build_s': elapsed,
+        'sandboxed_lateness': common.summarize(lateness),
+        'in_process_lateness': common.summarize(baseline),
+    }
+
+
+if __name__ == '__main__':
+    result = run()
+    print('build %.2fs; deadline lateness p99/max: sandboxed %.4f/%.4fs, in-process %.4f/%.4fs' % (
+        result['build_s'],
+        result['sandboxed_lateness']['p99'], result['sandboxed_lateness']['max'],
+        result['in_process_lateness']['p99'], result['in_process_lateness']['max']))
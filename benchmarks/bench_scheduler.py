@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import common
+from scheduler import Scheduler
+from timeline import Timeline, Executor, RecordingTarget, SimulatedClock
+
+
+def load(scheduler, count):
+    for i in range(count):
+        if i % 4 == 0:
+            scheduler.push('roll', 1, 1, 0.5)
+        elif i % 4 == 1:
+            scheduler.push('move_arm', 'left', i % 180)
+        elif i % 4 == 2:
+            scheduler.push('sync', ('turn', (1, -1, 0.5)), ('move_arm', ('right', 90)))
+        else:
+            scheduler.push('wait', 0.1)
+
+
+async def eager_baseline(count):
+    # The list-of-coroutines queue Routine.flush_queue used before Scheduler
+    async def roll():
+        pass
+    queue = []
+    for i in range(count):
+        queue.append(roll())
+    while len(queue) > 0:
+        await queue.pop(0)
+
+
+def bench(count):
+    scheduler = Scheduler()
+    clock = SimulatedClock()
+    target = RecordingTarget(clock)
+
+    start = time.perf_counter()
+    load(scheduler, count)
+    loaded = time.perf_counter()
+    timeline = Timeline()
+    timeline.add(scheduler.take())
+    compiled = time.perf_counter()
+    asyncio.run(Executor(target, clock).run(timeline))
+    drained = time.perf_counter()
+    asyncio.run(eager_baseline(count))
+    baseline = time.perf_counter()
+
+    return {
+        'actions': count,
+        'load_s': loaded - start,
+        'compile_s': compiled - loaded,
+        'drain_s': drained - compiled,
+        'per_action_us': (drained - start) / count * 1e6,
+        'eager_baseline_s': baseline - drained,
+        'commands': len(target.log),
+        'simulated_s': clock.now(),
+    }
+
+
+def run():
+    return {str(count): bench(count) for count in (10000, 100000)}
+
+
+def main():
+    for result in run().values():
+        print('%(actions)7d actions: load %(load_s).3fs, compile %(compile_s).3fs, drain %(drain_s).3fs '
+              '(%(per_action_us).2fus/action, %(simulated_s).0fs simulated), '
+              'list.pop(0) baseline %(eager_baseline_s).3fs' % result)
+
+
+if __name__ == '__main__':
+    main()
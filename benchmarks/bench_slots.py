@@ -0,0 +1,60 @@
+import tempfile
+import time
+
+import common
+
+
+def blockly_xml(size):
+    block = ('<block type="robot_roll" id="%06d"><field name="direction">forward</field>'
+             '<field name="seconds">1</field><next>')
+    blocks = []
+    while sum(map(len, blocks)) < size:
+        blocks.append(block % len(blocks))
+    return '<xml xmlns="https://developers.google.com/blockly/xml">' + ''.join(blocks) + '</xml>'
+
+
+def run(sizes=(1000, 10000, 100000, 1000000), iterations=20):
+    import falcon.testing
+    import server
+    from slots import SlotStore
+
+    with tempfile.TemporaryDirectory() as directory:
+        return measure(falcon.testing.TestClient(server.create_app(host=object(), slots=SlotStore(directory))),
+                       sizes, iterations)
+
+
+def measure(client, sizes, iterations):
+    results = {}
+    for size in sizes:
+        slot = {'name': 'Slot 1', 'data': blockly_xml(size)}
+        put, get_identity, get_gzip, not_modified = [], [], [], []
+        for i in range(iterations):
+            start = time.perf_counter()
+            client.simulate_put('/api/slots/1', json=slot)
+            put.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            result = client.simulate_get('/api/slots/1')
+            get_identity.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            result = client.simulate_get('/api/slots/1', headers={'Accept-Encoding': 'gzip'})
+            get_gzip.append(time.perf_counter() - start)
+            etag = result.headers['ETag']
+
+            start = time.perf_counter()
+            client.simulate_get('/api/slots/1', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+            not_modified.append(time.perf_counter() - start)
+
+        results[str(size)] = {
+            'put_s': common.summarize(put),
+            'get_s': common.summarize(get_identity),
+            'get_gzip_s': common.summarize(get_gzip),
+            'get_not_modified_s': common.summarize(not_modified),
+            'gzip_bytes': len(result.content),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    print(run())
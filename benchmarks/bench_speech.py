@@ -0,0 +1,40 @@
+import asyncio
+import tempfile
+import time
+
+import common
+from control import Speech
+from hardware import SimulatedBackend
+from speechcache import SpeechCache
+
+
+async def measure(phrases, directory):
+    backend = SimulatedBackend(tts_delay=0.0)
+    speech = Speech(backend.tts(), SpeechCache(directory), backend.audio_player())
+
+    misses = []
+    for text in phrases:
+        start = time.perf_counter()
+        path, download = speech.fetch(text)
+        await download
+        misses.append(time.perf_counter() - start)
+
+    hits = []
+    for _ in range(10):
+        for text in phrases:
+            start = time.perf_counter()
+            path, download = speech.fetch(text)
+            hits.append(time.perf_counter() - start)
+            assert download is None
+
+    backend.close()
+    return {'miss_s': common.summarize(misses), 'hit_s': common.summarize(hits), 'cache': speech.cache.stats()}
+
+
+def run(count=200):
+    with tempfile.TemporaryDirectory() as directory:
+        return asyncio.run(measure(['Hello number %d, nice to meet you' % i for i in range(count)], directory))
+
+
+if __name__ == '__main__':
+    print(run())
@@ -0,0 +1,85 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import common
+from host import HostConnection, HostError
+
+
+def notify_socket(directory):
+    # Stands in for systemd, to time the READY=1 a Type=notify unit waits for
+    path = os.path.join(directory, 'notify')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    return sock, path
+
+
+def slowest_imports(log, count=10):
+    # Top-level entries of python -X importtime, by cumulative microseconds. The
+    # sandbox's forkserver and worker share stderr, so their imports are listed too
+    imports = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith(' ' * 2):
+            imports.append((int(cumulative), name.strip()))
+    return [{'module': name, 'cumulative_s': us / 1e6} for us, name in sorted(imports, reverse=True)[:count]]
+
+
+def wait_for_stage(host, stage, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            startup = host.request('STATS')['stats']['sources']['startup']
+            if stage in startup:
+                return startup
+        except HostError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError('Host never reached ' + stage)
+        time.sleep(0.01)
+
+
+def run():
+    data_dir = tempfile.mkdtemp(prefix='robot-startup-')
+    control = os.path.join(data_dir, 'control')
+    notify, notify_path = notify_socket(data_dir)
+    # A file rather than a pipe, which the sandbox's forkserver would hold open
+    log = tempfile.TemporaryFile('w+')
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', 'robot.py', '--simulate', '--data', data_dir, '--socket', control],
+        cwd=os.path.join(common.ROOT, 'host'), env=dict(os.environ, NOTIFY_SOCKET=notify_path),
+        stdout=subprocess.DEVNULL, stderr=log)
+    try:
+        notify.settimeout(30)
+        while b'READY=1' not in notify.recv(4096):
+            pass
+        ready = time.monotonic() - start
+        stages = wait_for_stage(HostConnection(control, timeout=30), 'warm')
+    finally:
+        process.terminate()
+        process.wait()
+        notify.close()
+        shutil.rmtree(data_dir, ignore_errors=True)
+    log.seek(0)
+    return {
+        'ready_s': ready,
+        'stages_s': {name: stages[name] for name in ('imports', 'hardware', 'listening', 'warm')},
+        'slowest_imports': slowest_imports(log.read()),
+    }
+
+
+if __name__ == '__main__':
+    result = run()
+    print('READY=1 after %.3fs' % result['ready_s'])
+    for name, seconds in result['stages_s'].items():
+        print('  %-10s %.3fs after process start' % (name, seconds))
+    print('Slowest imports:')
+    for entry in result['slowest_imports']:
+        print('  %-40s %.3fs' % (entry['module'], entry['cumulative_s']))
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'host'))
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples) if samples else None,
+        'p50': percentile(samples, 50),
+        'p99': percentile(samples, 99),
+        'max': max(samples) if samples else None,
+    }
+
+
+class SimulatedHost:
+    # A Robot on simulated hardware serving the control socket from its own thread
+    def __init__(self, tts_delay=0.0):
+        from hardware import SimulatedBackend
+
+        self.data_dir = tempfile.mkdtemp(prefix='robot-bench-')
+        self.socket = os.path.join(self.data_dir, 'control')
+        self.backend = SimulatedBackend(tts_delay=tts_delay)
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.serve(), self.loop)
+        self.ready.wait()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.call(self.shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.backend.close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    async def shutdown(self):
+        # Let connection handlers see their clients hang up before cancelling the rest
+        self.server.close()
+        self.robot.sandbox.close()
+        await asyncio.sleep(0.05)
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def serve(self):
+        from robot import Robot
+
+        # media/ paths are relative to host/
+        os.chdir(os.path.join(ROOT, 'host'))
+        self.robot = Robot(self.loop, self.backend, data_dir=self.data_dir)
+        self.server = await asyncio.start_unix_server(self.robot.handle_connection, self.socket)
+        await self.robot.warm_up()
+        self.ready.set()
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
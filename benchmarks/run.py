@@ -0,0 +1,81 @@
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+
+import common
+
+
+BENCHMARKS = ['bench_scheduler', 'bench_program', 'bench_joystick', 'bench_slots', 'bench_speech',
+              'bench_sandbox', 'bench_fleet', 'bench_asgi', 'bench_startup']
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=common.ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, prefix + key + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix + key, value
+
+
+def compare(old, new):
+    old_values = dict(flatten(old['results']))
+    for key, value in flatten(new['results']):
+        if old_values.get(key):
+            print('%-60s %14.6g %14.6g %+7.1f%%' % (key, old_values[key], value, (value / old_values[key] - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the host and server benchmarks on simulated hardware')
+    parser.add_argument('benchmarks', nargs='*', default=BENCHMARKS)
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<date>-<revision>.json)')
+    parser.add_argument('--compare', help='earlier JSON results file to compare against')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.benchmarks:
+        print('Running', name)
+        try:
+            module = importlib.import_module(name)
+            results[name] = module.run()
+        except ImportError as e:
+            # e.g. falcon is only installed in the server's virtualenv
+            print('  skipped:', e)
+            results[name] = {'skipped': str(e)}
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    output = args.output
+    if not output:
+        directory = os.path.join(common.ROOT, 'benchmarks', 'results')
+        os.makedirs(directory, exist_ok=True)
+        output = os.path.join(directory, '%s-%s.json' % (
+            datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), report['revision'] or 'unknown'))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to', output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
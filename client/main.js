@@ -6,6 +6,20 @@ Blockly.Python = require('blockly/python');
 import {addBlocks} from './blocks.js';
 addBlocks(Blockly);
 
+// Blockly XML compresses well, so upload it gzipped where the browser can
+function putSlot(id, slot) {
+    var body = JSON.stringify(slot);
+    var headers = {'Content-Type': 'application/json'};
+    if (!window.CompressionStream) {
+        return axios.put('/api/slots/' + id, body, {headers: headers});
+    }
+    var stream = new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'));
+    return new Response(stream).arrayBuffer().then(function(compressed){
+        headers['Content-Encoding'] = 'gzip';
+        return axios.put('/api/slots/' + id, compressed, {headers: headers});
+    });
+}
+
 document.addEventListener('DOMContentLoaded', function(e) {
     Blockly.Python.INDENT = '    ';
     var blocklyArea = document.getElementById('blocklyArea');
@@ -13,11 +27,19 @@ document.addEventListener('DOMContentLoaded', function(e) {
     var workspace = Blockly.inject('blocklyDiv',
         {toolbox: document.getElementById('toolbox')});
 
-    document.getElementById('run').addEventListener('click', function(e){
-        axios.post('/api/program', {
-            program: Blockly.Python.workspaceToCode(workspace),
-        });
-    }, false);
+    // Reload swaps an edited program into the running one where it has got to
+    ['run', 'reload'].forEach(function(id) {
+        document.getElementById(id).addEventListener('click', function(e){
+            axios.post('/api/program', {
+                program: Blockly.Python.workspaceToCode(workspace),
+                reload: id == 'reload',
+            }).catch(function(error){
+                if (error.response && error.response.data.description) {
+                    window.alert(error.response.data.description);
+                }
+            });
+        }, false);
+    });
 
     document.getElementById('stop').addEventListener('click', function(e){
         axios.post('/api/program', {
@@ -25,6 +47,27 @@ document.addEventListener('DOMContentLoaded', function(e) {
         });
     }, false);
 
+    // Live progress from the robot, where the server relays its events
+    if (window.EventSource) {
+        var status = document.getElementById('status');
+        var describe = {
+            started: function(event) { return 'Running'; },
+            reloaded: function(event) { return 'Reloaded'; },
+            action: function(event) { return 'Running: ' + event.action.replace('_', ' '); },
+            button: function(event) { return 'Button ' + event.button.slice(1) + ' pressed'; },
+            finished: function(event) { return 'Finished'; },
+            stopped: function(event) { return 'Stopped'; },
+            error: function(event) { return 'Error: ' + event.message; },
+            disconnected: function(event) { return 'Robot offline'; },
+        };
+        var events = new EventSource('/api/events');
+        Object.keys(describe).forEach(function(name) {
+            events.addEventListener(name, function(e) {
+                status.textContent = describe[name](JSON.parse(e.data));
+            });
+        });
+    }
+
     var blocklyResize = function(e) {
         // Compute the absolute coordinates and dimensions of blocklyArea.
         var element = blocklyArea;
@@ -52,6 +95,7 @@ document.addEventListener('DOMContentLoaded', function(e) {
             data: {
                 slots: response.data,
                 activeIndex: 0,
+                shown: null,
             },
             computed: {
                 active() {
@@ -68,19 +112,40 @@ document.addEventListener('DOMContentLoaded', function(e) {
                     }
                     this.updateWorkspace();
                 },
-                updateWorkspace() {
-                    workspace.clear();
-                    if (this.slots[this.activeIndex].data) {
-                        var xml = Blockly.Xml.textToDom(this.slots[this.activeIndex].data);
-                        Blockly.Xml.domToWorkspace(xml, workspace);
+                load(slot) {
+                    if (slot.data !== undefined) {
+                        return Promise.resolve(slot);
                     }
+                    return axios.get('/api/slots/' + slot.id).then(function(response){
+                        Vue.set(slot, 'data', response.data.data);
+                        return slot;
+                    });
+                },
+                updateWorkspace() {
+                    var app = this;
+                    this.load(this.active).then(function(slot){
+                        if (slot !== app.active) {
+                            return;
+                        }
+                        app.shown = slot;
+                        workspace.clear();
+                        if (slot.data) {
+                            var xml = Blockly.Xml.textToDom(slot.data);
+                            Blockly.Xml.domToWorkspace(xml, workspace);
+                        }
+                    });
                 },
                 save() {
+                    // Save to the slot the workspace is showing, which may lag behind a switch
+                    var slot = this.shown;
+                    if (!slot) {
+                        return;
+                    }
                     var xml = Blockly.Xml.workspaceToDom(workspace, true);
                     var data = Blockly.Xml.domToText(xml);
-                    if (data != this.slots[this.activeIndex].data) {
-                        this.slots[this.activeIndex].data = data;
-                        axios.post('/api/slots', this.slots);
+                    if (data != slot.data) {
+                        slot.data = data;
+                        putSlot(slot.id, {name: slot.name, data: data});
                     }
                 },
             },
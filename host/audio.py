@@ -0,0 +1,147 @@
+import asyncio
+import io
+import wave
+from collections import OrderedDict
+
+
+# Every sound is converted to this format once, when it is loaded, so the
+# output stream never has to be reopened or reconfigured
+RATE = 24000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+BYTES_PER_SECOND = RATE * CHANNELS * SAMPLE_WIDTH
+
+CHUNK = BYTES_PER_SECOND // 50  # 20 ms
+LEAD = 0.1  # How far ahead of the speaker the stream is allowed to run
+
+
+def silence(secs):
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as f:
+        f.setnchannels(CHANNELS)
+        f.setsampwidth(SAMPLE_WIDTH)
+        f.setframerate(RATE)
+        f.writeframes(bytes(int(secs * RATE) * CHANNELS * SAMPLE_WIDTH))
+    return out.getvalue()
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as f:
+        if (f.getframerate(), f.getnchannels(), f.getsampwidth()) != (RATE, CHANNELS, SAMPLE_WIDTH):
+            raise ValueError('Unsupported audio format: ' + path)
+        return f.readframes(f.getnframes())
+
+
+class AplaySink:
+    def __init__(self):
+        self.process = None
+
+    async def write(self, pcm):
+        if self.process is None or self.process.returncode is not None:
+            self.process = await asyncio.create_subprocess_exec(
+                '/usr/bin/aplay', '-q', '-t', 'raw', '-f', 'S16_LE', '-r', str(RATE), '-c', str(CHANNELS), '-',
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        self.process.stdin.write(pcm)
+        await self.process.stdin.drain()
+
+    def reset(self):
+        # aplay holds up to LEAD plus the ALSA buffer; killing it silences that
+        # at once, and the next write starts a fresh process
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+        self.process = None
+
+
+class NullSink:
+    # Discards audio, for running without a sound card
+    def __init__(self):
+        self.written = 0
+
+    async def write(self, pcm):
+        self.written += len(pcm)
+
+    def reset(self):
+        pass
+
+
+class AudioPlayer:
+    def __init__(self, sink, cache_bytes=16 * 1024 * 1024):
+        self.sink = sink
+        self.cache_bytes = cache_bytes
+        self.sounds = OrderedDict()
+        self.cached = 0
+        self.queue = asyncio.Queue()
+        self.worker = None
+        self.current = None
+        self.playhead = 0.0
+
+    async def decode(self, path):
+        if not path.endswith('.mp3'):
+            return read_wav(path)
+        # mpg123 is a system package (apt install mpg123), listed in requirements.txt
+        decoder = await asyncio.create_subprocess_exec(
+            '/usr/bin/mpg123', '-q', '-m', '-r', str(RATE), '-e', 's16', '-s', path,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            pcm, _ = await decoder.communicate()
+        except asyncio.CancelledError:
+            decoder.kill()
+            raise
+        return pcm
+
+    async def load(self, path):
+        pcm = self.sounds.get(path)
+        if pcm is not None:
+            self.sounds.move_to_end(path)
+            return pcm
+
+        pcm = self.sounds[path] = await self.decode(path)
+        self.cached += len(pcm)
+        while self.cached > self.cache_bytes and len(self.sounds) > 1:
+            self.cached -= len(self.sounds.popitem(last=False)[1])
+        return pcm
+
+    async def play_file(self, path):
+        await self.play(await self.load(path))
+
+    def play(self, pcm):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+        done = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((pcm, done))
+        return done
+
+    def cancel(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()[1].cancel()
+        if self.current is not None:
+            self.current.cancel()
+            self.sink.reset()
+            self.playhead = 0.0
+
+    async def run(self):
+        while True:
+            pcm, done = await self.queue.get()
+            self.current = done
+            try:
+                await self.stream(pcm, done)
+            except Exception as e:
+                if not done.done():
+                    done.set_exception(e)
+            else:
+                if not done.done():
+                    done.set_result(None)
+            finally:
+                self.current = None
+
+    async def stream(self, pcm, done):
+        loop = asyncio.get_running_loop()
+        for offset in range(0, len(pcm), CHUNK):
+            # Cancelling the waiter (e.g. a stopped routine) ends playback at the next chunk
+            if done.done():
+                return
+            chunk = pcm[offset:offset + CHUNK]
+            await self.sink.write(chunk)
+            self.playhead = max(self.playhead, loop.time()) + len(chunk) / BYTES_PER_SECOND
+            await asyncio.sleep(max(0.0, self.playhead - LEAD - loop.time()))
+        await asyncio.sleep(max(0.0, self.playhead - loop.time()))
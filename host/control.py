@@ -1,73 +1,210 @@
 import array
 import struct
 from fcntl import ioctl
-import hashlib
-import os.path
+import os
 import asyncio
+import functools
+import importlib
+import time
 
-import RPi.GPIO as GPIO
-from adafruit_motor import servo
-from google.cloud import texttospeech_v1 as texttospeech
+import audio
+from metrics import metrics, instrumented
+from motion import Profile, ramp, reach, clamp
+from pwm import Servo
+from timeline import estimate_speech
 
 
 class Wheels:
-    def __init__(self, pca, channels):
-        self.motor0 = servo.ContinuousServo(pca.channels[channels[0]])
-        self.motor1 = servo.ContinuousServo(pca.channels[channels[1]])
-        self.motor2 = servo.ContinuousServo(pca.channels[channels[2]])
-        self.motor3 = servo.ContinuousServo(pca.channels[channels[3]])
+    def __init__(self, pwm, channels, motion=None):
+        self.pwm = pwm
+        self.motion = motion
+        self.motor0 = Servo(pwm, channels[0])
+        self.motor1 = Servo(pwm, channels[1])
+        self.motor2 = Servo(pwm, channels[2])
+        self.motor3 = Servo(pwm, channels[3])
+        self.speeds = (0.0, 0.0)
 
         self.stop()
 
+    @instrumented('wheels.go')
     def go(self, left_speed=1.0, right_speed=1.0):
-        self.motor1.throttle = self.motor3.throttle = 0.125 + 0.125 * left_speed
-        self.motor0.throttle = self.motor2.throttle = 0.125 - 0.125 * right_speed
-
+        # Ramped, so the motors never step from standstill to full current
+        target = (left_speed, right_speed)
+        if self.motion is None:
+            self.set(target)
+        elif target != self.speeds or self.motion.moving(self):
+            self.motion.start(self, ramp(self.speeds, target, self.motion.period), self.set)
+
+    def set(self, speeds):
+        left_speed, right_speed = speeds
+        with self.pwm.batch():
+            self.motor1.throttle = self.motor3.throttle = 0.125 + 0.125 * left_speed
+            self.motor0.throttle = self.motor2.throttle = 0.125 - 0.125 * right_speed
+        self.speeds = speeds
+
+    @instrumented('wheels.stop')
     def stop(self):
-        self.motor0.throttle = self.motor1.throttle = self.motor2.throttle = self.motor3.throttle = 0.125
+        # At once, for emergency stops; a ramped stop is go(0, 0)
+        if self.motion is not None:
+            self.motion.cancel(self)
+        with self.pwm.batch():
+            self.motor0.throttle = self.motor1.throttle = self.motor2.throttle = self.motor3.throttle = 0.125
+        self.speeds = (0.0, 0.0)
 
 
 class Arm:
-    def __init__(self, pca, channel, transform=lambda t: t):
-        self.motor = servo.Servo(pca.channels[channel], min_pulse=750, max_pulse=2600)
+    def __init__(self, pwm, channel, transform=lambda t: t, motion=None):
+        self.motor = Servo(pwm, channel, min_pulse=750, max_pulse=2600)
         self.transform = transform
+        self.limits = reach(transform)
+        self.motion = motion
+        self.position = None
         self.move(0)
 
+    @instrumented('arm.move')
     def move(self, angle):
+        # Past its limits the arm would stop partway, with the move planned and
+        # timed for the whole swing
+        angle = clamp(angle, self.limits)
+        # Where the arm is is unknown until it is first set, so that first move is a jump
+        if self.motion is None or self.position is None:
+            self.set(angle)
+        else:
+            self.motion.start(self, Profile(self.position, angle).sample(self.motion.period), self.set)
+
+    def set(self, angle):
         self.motor.angle = min(max(self.transform(angle), 0), 180)
+        self.position = angle
 
 
 class Light:
-    def __init__(self, pin_number):
+    def __init__(self, gpio, pin_number):
+        self.gpio = gpio
         self.pin_number = pin_number
-        GPIO.setup(pin_number, GPIO.OUT, initial=GPIO.LOW)
+        gpio.setup(pin_number, gpio.OUT, initial=gpio.LOW)
 
     def on(self):
-        GPIO.output(self.pin_number, GPIO.HIGH)
+        self.gpio.output(self.pin_number, self.gpio.HIGH)
     
     def off(self):
-        GPIO.output(self.pin_number, GPIO.LOW)
+        self.gpio.output(self.pin_number, self.gpio.LOW)
     
+    @instrumented('light.set')
     def set(self, state):
-        GPIO.output(self.pin_number, state)
+        self.gpio.output(self.pin_number, state)
 
 
-class Speech:
+class GoogleTTS:
     def __init__(self, key_file):
-        self.client = texttospeech.TextToSpeechAsyncClient.from_service_account_file(key_file)
-        self.voice = texttospeech.types.VoiceSelectionParams(language_code='en-US', name="en-US-Wavenet-F")
-        self.config = texttospeech.types.AudioConfig(audio_encoding=texttospeech.types.AudioEncoding.MP3)
+        # The client library takes seconds to import on a Pi, so it is only
+        # loaded once the host is up (see connect)
         self.key_file = key_file
+        self.client = None
+        self.connecting = None
+
+        # Identifies the voice and audio settings in speech cache keys
+        self.config_id = ['google', 'en-US', 'en-US-Wavenet-F', 'LINEAR16', audio.RATE]
+
+    async def connect(self):
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(self.load())
+        await asyncio.shield(self.connecting)
+
+    async def load(self):
+        # Imported in a thread to keep the event loop going, but the client is
+        # made on the loop, which its async channel binds to
+        try:
+            texttospeech = await asyncio.to_thread(importlib.import_module, 'google.cloud.texttospeech_v1')
+        except Exception:
+            self.connecting = None  # Tried again by the next synthesize
+            raise
+        self.types = texttospeech.types
+        self.client = texttospeech.TextToSpeechAsyncClient.from_service_account_file(self.key_file)
+        self.voice = self.types.VoiceSelectionParams(language_code='en-US', name="en-US-Wavenet-F")
+        self.config = self.types.AudioConfig(audio_encoding=self.types.AudioEncoding.LINEAR16, sample_rate_hertz=audio.RATE)
+
+    async def synthesize(self, text):
+        if self.client is None:
+            await self.connect()
+        speech_input = self.types.SynthesisInput(text=text)
+        response = await self.client.synthesize_speech(input=speech_input, voice=self.voice, audio_config=self.config)
+        return response.audio_content
+
+
+class StubTTS:
+    # Offline stand-in for GoogleTTS that returns silence as long as the text after a fixed delay
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self.config_id = ['stub']
+
+    async def connect(self):
+        pass
+
+    async def synthesize(self, text):
+        self.requests.append(text)
+        await asyncio.sleep(self.delay)
+        return audio.silence(0.05 * len(text))
+
+
+class Speech:
+    def __init__(self, tts, cache, player, concurrency=4):
+        self.tts = tts
+        self.cache = cache
+        self.player = player
+        self.downloads = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    def fetch(self, text):
+        key = self.cache.key(text, self.tts.config_id)
+        path = self.cache.get(key)
+        if path is not None:
+            return path, None
+
+        download = self.downloads.get(key)
+        if download is None:
+            download = self.downloads[key] = asyncio.ensure_future(self.download(key, text))
+            download.add_done_callback(functools.partial(self.downloaded, key))
+        return None, download
+
+    async def download(self, key, text):
+        async with self.semaphore:
+            start = time.perf_counter()
+            data = await self.tts.synthesize(text)
+            if metrics.enabled:
+                metrics.observe('tts.round_trip', time.perf_counter() - start)
+        path = self.cache.put(key, text, data)
+        # Decode ahead of time so playback starts straight from memory
+        await self.player.load(path)
+        return path
+
+    def downloaded(self, key, download):
+        del self.downloads[key]
+        # Retrieve failures of prefetches nobody awaited; synthesize() will retry them
+        if not download.cancelled():
+            download.exception()
+
+    def prefetch(self, phrases):
+        for text in phrases:
+            self.fetch(text)
+
+    def cancel(self):
+        # Abort in-flight synthesis; anything still wanted is fetched again on demand
+        for download in list(self.downloads.values()):
+            download.cancel()
+
+    def estimate(self, text):
+        pcm = self.player.sounds.get(self.cache.path(self.cache.key(text, self.tts.config_id)))
+        if pcm is not None:
+            return len(pcm) / audio.BYTES_PER_SECOND
+        return estimate_speech(text)
 
     async def synthesize(self, text):
-        cache = '/tmp/speech-%s.mp3' % hashlib.sha1(text.encode('ascii')).hexdigest()
-        if not os.path.exists(cache):
-            speech_input = texttospeech.types.SynthesisInput(text=text)
-            response = await self.client.synthesize_speech(input=speech_input, voice=self.voice, audio_config=self.config)
-            with open(cache, 'wb') as out:
-                out.write(response.audio_content)
-        output = await asyncio.create_subprocess_exec('/usr/bin/mpg321', cache, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
-        await output.wait()
+        path, download = self.fetch(text)
+        if download is not None:
+            # Shielded so a cancelled routine does not abort a download others may share
+            path = await asyncio.shield(download)
+        await self.player.play_file(path)
 
 
 # Joystick access methods sourced heavily from https://gist.github.com/rdb/8864666 (Public Domain per the Unilicense)
@@ -145,78 +282,159 @@ button_names = {
 }
 
 
+ABS_CNT = 0x40
+KEY_CNT = 0x300
+ABS_X = 0x00
+ABS_Y = 0x01
+
+# Names by code, for every code a js device can report
+axis_labels = [axis_names.get(code, 'unknown(0x%02x)' % code) for code in range(ABS_CNT)]
+button_labels = [button_names.get(code, 'unknown(0x%03x)' % code) for code in range(KEY_CNT)]
+
+
+class Controls:
+    # State of every connected controller together. Axes and buttons are kept
+    # in arrays indexed by input code, so an event from any controller lands in
+    # the same slot, and names are only looked up when callbacks are added
+    def __init__(self):
+        self.axis_states = array.array('d', [0.0] * ABS_CNT)
+        self.button_states = bytearray(KEY_CNT)
+        self.axis_callbacks = [[] for code in range(ABS_CNT)]
+        self.button_callbacks = [[] for code in range(KEY_CNT)]
+
+        self.reads = 0
+        self.events = 0
+        self.axis_events = 0
+        self.event_time = None
+
+    def add_button_callback(self, button_name, cb):
+        # Some names have a code per controller family, as the d-pad does
+        for code, label in enumerate(button_labels):
+            if label == button_name:
+                self.button_callbacks[code].append(cb)
+
+    def add_axis_callback(self, axis_name, cb):
+        self.axis_callbacks[axis_labels.index(axis_name)].append(cb)
+
+    def release(self, now):
+        # A controller unplugged mid-push must not leave the robot driving
+        for code in range(ABS_CNT):
+            self.axis_states[code] = 0.0
+        self.axis_events += 1
+        self.event_time = now
+
+
 class Joystick:
-    def __init__(self, device='/dev/input/js0'):
-        self.dev = open(device, 'rb')
+    def __init__(self, device='/dev/input/js0', axes=None, buttons=None, name=None, controls=None):
+        # Either a js device path, or an already open event stream. Devices
+        # without the js ioctls (FIFOs, pipes) are given their axis and button codes
+        if isinstance(device, str):
+            # Non-blocking, as opening a FIFO would otherwise wait for a writer
+            device = os.fdopen(os.open(device, os.O_RDONLY | os.O_NONBLOCK), 'rb', buffering=0)
+        self.dev = device
+        self.fd = self.dev.fileno()
+        os.set_blocking(self.fd, False)
         self.loop = None
+        self.controls = controls or Controls()
+        self.on_lost = None
+
+        if axes is None or buttons is None:
+            name, axes, buttons = self.query()
+        self.name = name
+        self.num_axes = len(axes)
+        self.num_buttons = len(buttons)
 
+        # Index tables from this device's axis and button numbers to input codes
+        self.axis_map = list(axes)
+        self.button_map = list(buttons)
+
+    def query(self):
         # Device name
         buf = array.array('B', [0] * 64)
         ioctl(self.dev, 0x80006a13 + (0x10000 * len(buf)), buf)  # JSIOCGNAME(len)
-        self.name = buf.tobytes().decode('ascii')
+        name = buf.tobytes().decode('ascii')
 
         # Number of axes
         buf = array.array('B', [0])
         ioctl(self.dev, 0x80016a11, buf)  # JSIOCGAXES
-        self.num_axes = buf[0]
+        num_axes = buf[0]
 
         # Number of buttons
         buf = array.array('B', [0])
         ioctl(self.dev, 0x80016a12, buf)  # JSIOCGBUTTONS
-        self.num_buttons = buf[0]
+        num_buttons = buf[0]
 
         # Axis map
-        self.axis_map = []
-        self.axis_callbacks = {}
-        self.axis_states = {}
         buf = array.array('B', [0] * 0x40)
         ioctl(self.dev, 0x80406a32, buf)  # JSIOCGAXMAP
-        for axis in buf[:self.num_axes]:
-            axis_name = axis_names.get(axis, 'unknown(0x%02x)' % axis)
-            self.axis_map.append(axis_name)
-            self.axis_callbacks[axis_name] = []
-            self.axis_states[axis_name] = 0.0
+        axes = list(buf[:num_axes])
 
         # Button map
-        self.button_map = []
-        self.button_callbacks = {}
-        self.button_states = {}
         buf = array.array('H', [0] * 200)
         ioctl(self.dev, 0x80406a34, buf)  # JSIOCGBTNMAP
-        for btn in buf[:self.num_buttons]:
-            btn_name = button_names.get(btn, 'unknown(0x%03x)' % btn)
-            self.button_map.append(btn_name)
-            self.button_callbacks[btn_name] = []
-            self.button_states[btn_name] = 0
+        buttons = list(buf[:num_buttons])
+
+        return name, axes, buttons
 
+    @instrumented('joystick.read')
     def get_input(self):
-        evbuf = self.dev.read(8)
-        if evbuf:
-            time, value, type, number = struct.unpack('IhBB', evbuf)
-            if type & 0x80:
-                pass
+        # Drain every pending event in one pass, then notify each changed axis
+        # once with its latest state instead of once per intermediate event
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.fd, 8 * 64)
+            except BlockingIOError:
+                break
+            except OSError:
+                chunk = None
+            if not chunk:
+                if data:
+                    break
+                # Unplugged: a js device fails with ENODEV, a FIFO reads EOF
+                self.deregister()
+                if self.on_lost is not None:
+                    self.on_lost(self)
+                return
+            data += chunk
+            if len(chunk) < 8 * 64:
+                break
+
+        controls = self.controls
+        controls.reads += 1
+        controls.event_time = self.loop.time()
+        axis_map, axis_states, axis_callbacks = self.axis_map, controls.axis_states, controls.axis_callbacks
+        button_map, button_states, button_callbacks = self.button_map, controls.button_states, controls.button_callbacks
+        call_soon = self.loop.call_soon
+        changed_axes = set()
+        for time, value, type, number in struct.iter_unpack('IhBB', data):
             if type & 0x01:
-                button = self.button_map[number]
-                self.button_states[button] = value
-                for cb in self.button_callbacks[button]:
-                    self.loop.call_soon(cb, self, button, self.button_states[button])
+                code = button_map[number]
+                button_states[code] = value
+                for cb in button_callbacks[code]:
+                    call_soon(cb, self, button_labels[code], value)
             if type & 0x02:
-                axis = self.axis_map[number]
-                self.axis_states[axis] = value / 32767.0
-                for cb in self.axis_callbacks[axis]:
-                    self.loop.call_soon(cb, self, axis, self.axis_states[axis])
+                code = axis_map[number]
+                axis_states[code] = value / 32767.0
+                changed_axes.add(code)
+        controls.events += len(data) // 8
+
+        if changed_axes:
+            controls.axis_events += 1
+        for code in changed_axes:
+            for cb in axis_callbacks[code]:
+                call_soon(cb, self, axis_labels[code], axis_states[code])
 
     def register(self, loop):
         if self.loop:
             self.deregister()
         self.loop = loop
-        loop.add_reader(self.dev, self.get_input)
+        loop.add_reader(self.fd, self.get_input)
 
     def deregister(self):
-        self.loop.remove_reader(self.dev)
-
-    def add_button_callback(self, button_name, cb):
-        self.button_callbacks[button_name].append(cb)
+        if self.loop:
+            self.loop.remove_reader(self.fd)
 
-    def add_axis_callback(self, axis_name, cb):
-        self.axis_callbacks[axis_name].append(cb)
+    def close(self):
+        self.deregister()
+        self.dev.close()
@@ -0,0 +1,91 @@
+import asyncio
+
+from control import ABS_X, ABS_Y
+
+
+class Drive:
+    def __init__(self, controls, wheels, rate=50, deadband=0.02):
+        self.controls = controls
+        self.wheels = wheels
+        self.period = 1.0 / rate
+        self.deadband = deadband
+        self.enabled = True
+        self.throttles = None
+        self.seen_events = 0
+
+        self.ticks = 0
+        self.writes = 0
+        self.skipped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def pause(self):
+        self.enabled = False
+
+    def resume(self):
+        # Something else has driven the wheels, so the next solution must be written
+        self.throttles = None
+        self.seen_events = self.controls.axis_events
+        self.enabled = True
+
+    def solve(self):
+        x_vector, y_vector = -self.controls.axis_states[ABS_X], -self.controls.axis_states[ABS_Y]
+
+        # Motor solutions taken from: http://home.kendra.com/mauser/joystick.html
+        v = y_vector * (2 - abs(x_vector))
+        w = x_vector * (2 - abs(y_vector))
+        L = (v - w) / 2.0
+        R = (v + w) / 2.0
+        return L, R
+
+    def unchanged(self, throttles):
+        if self.throttles is None:
+            return False
+        if throttles == (0.0, 0.0):
+            # Always settle exactly at rest, even from inside the deadband
+            return self.throttles == throttles
+        left, right = self.throttles
+        return abs(throttles[0] - left) <= self.deadband and abs(throttles[1] - right) <= self.deadband
+
+    def tick(self, now):
+        self.ticks += 1
+        if not self.enabled or self.controls.axis_events == self.seen_events:
+            return
+        self.seen_events = self.controls.axis_events
+
+        throttles = self.solve()
+        if self.unchanged(throttles):
+            self.skipped += 1
+            return
+
+        self.wheels.go(*throttles)
+        self.throttles = throttles
+        self.writes += 1
+
+        latency = now - self.controls.event_time
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            self.tick(loop.time())
+            deadline += self.period
+            delay = deadline - loop.time()
+            if delay < 0:
+                # Fell behind (e.g. a slow bus write); skip missed ticks rather than bursting
+                deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def metrics(self):
+        return {
+            'ticks': self.ticks,
+            'writes': self.writes,
+            'skipped': self.skipped,
+            'input_events': self.controls.events,
+            'input_reads': self.controls.reads,
+            'latency_mean': self.latency_total / self.writes if self.writes else 0.0,
+            'latency_max': self.latency_max,
+        }
@@ -0,0 +1,38 @@
+import time
+
+from protocol import encode_message
+
+
+MAX_BACKLOG = 256 * 1024  # Bytes a subscriber may fall behind before it is dropped
+
+
+class EventBus:
+    # Connections that sent SUBSCRIBE get every event as an unsolicited message
+    # with no request ID. Each event is encoded once and written to all of them
+    # without waiting, so a slow subscriber can never stall the control loop
+    def __init__(self):
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, writer):
+        self.subscribers.add(writer)
+
+    def unsubscribe(self, writer):
+        self.subscribers.discard(writer)
+
+    def publish(self, event, **fields):
+        if not self.subscribers:
+            return
+        self.published += 1
+        data = encode_message(dict(fields, id=None, event=event, time=time.time()))
+        for writer in list(self.subscribers):
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                self.subscribers.discard(writer)
+                writer.close()
+                self.dropped += 1
+            else:
+                writer.write(data)
+
+    def stats(self):
+        return {'subscribers': len(self.subscribers), 'published': self.published, 'dropped': self.dropped}
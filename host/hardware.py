@@ -0,0 +1,191 @@
+import os
+import struct
+import functools
+import subprocess
+import tempfile
+import time
+
+import audio
+from control import GoogleTTS, StubTTS, Joystick, button_labels, axis_labels
+from inputs import InputManager
+
+
+# A common USB gamepad layout: x, y, rx, ry and buttons b1 through rs
+SIMULATED_AXES = [0x00, 0x01, 0x03, 0x04]
+SIMULATED_BUTTONS = list(range(0x130, 0x13c))
+
+
+class PiBackend:
+    # Hardware libraries are imported here so the rest of host/ imports anywhere
+    def __init__(self, key_file='/home/pi/.google-key'):
+        import RPi.GPIO as GPIO
+
+        self.gpio = GPIO
+        self.gpio.setmode(GPIO.BCM)
+        self.key_file = key_file
+
+    def pca9685(self, frequency):
+        import busio
+        from board import SCL, SDA
+        from adafruit_pca9685 import PCA9685
+
+        pca = PCA9685(busio.I2C(SCL, SDA))
+        pca.frequency = frequency
+        return pca
+
+    def inputs(self, controls):
+        return InputManager(controls, '/dev/input')
+
+    def tts(self):
+        return GoogleTTS(self.key_file)
+
+    def audio_player(self):
+        return audio.AudioPlayer(audio.AplaySink())
+
+    def poweroff(self):
+        subprocess.run(['sudo', 'poweroff'])
+
+
+class SimulatedBackend:
+    def __init__(self, tts_delay=0.2, input_dir=None):
+        self.tts_delay = tts_delay
+        self.start = time.monotonic()
+
+        # (seconds since start, device, args) for every hardware command
+        self.log = []
+
+        self.gpio = SimulatedGPIO(self)
+
+        # FIFOs standing in for js devices, found by the same InputManager as on the Pi
+        self.input_dir = input_dir or tempfile.mkdtemp(prefix='robot-input-')
+        os.makedirs(self.input_dir, exist_ok=True)
+        self.joystick_fds = {}
+
+    def record(self, device, *args):
+        self.log.append((time.monotonic() - self.start, device, args))
+
+    def pca9685(self, frequency):
+        return SimulatedPCA9685(self, frequency)
+
+    def inputs(self, controls):
+        self.plug('js0')
+        opener = functools.partial(Joystick, axes=SIMULATED_AXES, buttons=SIMULATED_BUTTONS, name='Simulated joystick')
+        return InputManager(controls, self.input_dir, opener=opener)
+
+    def plug(self, device):
+        path = os.path.join(self.input_dir, device)
+        # One left by a simulator that was killed would still be there
+        if os.path.exists(path):
+            os.unlink(path)
+        os.mkfifo(path)
+        # Read-write, so opening never waits for the reader and the reader never sees EOF
+        self.joystick_fds[device] = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+
+    def unplug(self, device):
+        os.unlink(os.path.join(self.input_dir, device))
+        os.close(self.joystick_fds.pop(device))
+
+    def send_event(self, type, number, value, device='js0'):
+        ms = int((time.monotonic() - self.start) * 1000) & 0xffffffff
+        os.write(self.joystick_fds[device], struct.pack('IhBB', ms, value, type, number))
+
+    def press(self, button, state=1, device='js0'):
+        self.send_event(0x01, SIMULATED_BUTTONS.index(button_labels.index(button)), state, device)
+
+    def move(self, axis, value, device='js0'):
+        value = int(max(-1.0, min(1.0, value)) * 32767)
+        self.send_event(0x02, SIMULATED_AXES.index(axis_labels.index(axis)), value, device)
+
+    def tts(self):
+        return SimulatedTTS(self, self.tts_delay)
+
+    def audio_player(self):
+        return SimulatedAudioPlayer(self)
+
+    def poweroff(self):
+        self.record('poweroff')
+
+    def commands(self, device=None):
+        return [entry for entry in self.log if device is None or entry[1] == device]
+
+    def close(self):
+        for device in list(self.joystick_fds):
+            self.unplug(device)
+        try:
+            os.rmdir(self.input_dir)
+        except OSError:
+            pass
+
+
+class SimulatedGPIO:
+    BCM = 11
+    OUT = 0
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, initial=LOW):
+        self.backend.record('gpio', pin, initial)
+
+    def output(self, pin, value):
+        self.backend.record('gpio', pin, value)
+
+
+class SimulatedPCA9685:
+    def __init__(self, backend, frequency):
+        self.frequency = frequency
+        self.mode1_reg = 0xa0
+        self.i2c_device = SimulatedI2CDevice(backend)
+
+
+class SimulatedI2CDevice:
+    def __init__(self, backend):
+        self.backend = backend
+        self.transfers = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def write(self, buf):
+        # Auto-increment write starting at LED<n>_ON_L; record each channel's OFF count
+        self.transfers += 1
+        channel = (buf[0] - 0x06) // 4
+        for offset in range(1, len(buf), 4):
+            on, off = struct.unpack('<HH', buf[offset:offset + 4])
+            self.backend.record('pwm', channel, 4095 if on == 0x1000 else off)
+            channel += 1
+
+
+class SimulatedTTS(StubTTS):
+    def __init__(self, backend, delay):
+        super().__init__(delay)
+        self.backend = backend
+        self.config_id = ['simulated']
+
+    async def synthesize(self, text):
+        self.backend.record('tts', text)
+        return await super().synthesize(text)
+
+
+class SimulatedAudioPlayer(audio.AudioPlayer):
+    def __init__(self, backend):
+        super().__init__(audio.NullSink())
+        self.backend = backend
+
+    async def decode(self, path):
+        if path.endswith('.mp3'):
+            # No decoder off the robot; stand in a quarter second of silence
+            return bytes(audio.BYTES_PER_SECOND // 4)
+        return await super().decode(path)
+
+    def play(self, pcm):
+        self.backend.record('audio', len(pcm) / audio.BYTES_PER_SECOND)
+        return super().play(pcm)
@@ -0,0 +1,123 @@
+import asyncio
+import ctypes
+import os
+import re
+
+from control import Joystick
+
+
+DEVICE_PATTERN = re.compile(r'js\d+$')
+POLL_INTERVAL = 1.0
+
+# inotify(7)
+IN_ATTRIB = 0x004
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+
+def inotify_watch(directory):
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+    # Attribute changes too: udev makes a new device readable only after creating it
+    mask = IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        error = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(error, 'Cannot watch ' + directory)
+    return fd
+
+
+class InputManager:
+    # Opens every js device in a directory as it appears and closes it when it
+    # goes, so controllers can come and go and none need be there at startup.
+    # All of them read on the event loop into one Controls
+    def __init__(self, controls, directory='/dev/input', opener=Joystick):
+        self.controls = controls
+        self.directory = directory
+        self.opener = opener
+        self.controllers = {}
+        self.loop = None
+        self.watch_fd = None
+        self.poll_task = None
+        self.connected = 0
+        self.lost = 0
+
+    def start(self, loop):
+        self.loop = loop
+        try:
+            self.watch_fd = inotify_watch(self.directory)
+        except (OSError, AttributeError):
+            # No inotify (or no directory yet): look again every so often
+            self.poll_task = loop.create_task(self.poll())
+        else:
+            loop.add_reader(self.watch_fd, self.changed)
+        self.scan()
+        return self
+
+    def stop(self):
+        if self.watch_fd is not None:
+            self.loop.remove_reader(self.watch_fd)
+            os.close(self.watch_fd)
+            self.watch_fd = None
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        for path in list(self.controllers):
+            self.remove(path)
+
+    def changed(self):
+        # Which entries changed hardly matters; the directory is small
+        while True:
+            try:
+                os.read(self.watch_fd, 4096)
+            except BlockingIOError:
+                break
+        self.scan()
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            self.scan()
+
+    def scan(self):
+        try:
+            names = [name for name in os.listdir(self.directory) if DEVICE_PATTERN.match(name)]
+        except FileNotFoundError:
+            names = []
+        present = {os.path.join(self.directory, name) for name in names}
+        for path in list(self.controllers):
+            if path not in present:
+                self.remove(path)
+        for path in sorted(present):
+            if path not in self.controllers:
+                self.add(path)
+
+    def add(self, path):
+        try:
+            joystick = self.opener(path, controls=self.controls)
+        except OSError:
+            return  # Not readable yet; the permission change brings another scan
+        joystick.on_lost = lambda joystick: self.remove(path)
+        joystick.register(self.loop)
+        self.controllers[path] = joystick
+        self.connected += 1
+
+    def remove(self, path):
+        joystick = self.controllers.pop(path, None)
+        if joystick is None:
+            return
+        joystick.close()
+        self.controls.release(self.loop.time())
+        self.lost += 1
+
+    def stats(self):
+        return {
+            'controllers': len(self.controllers),
+            'connected': self.connected,
+            'lost': self.lost,
+            'events': self.controls.events,
+            'reads': self.controls.reads,
+        }
@@ -0,0 +1,101 @@
+import asyncio
+import bisect
+import functools
+import time
+
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        buckets = {str(bound): count for bound, count in zip(BUCKETS + ['inf'], self.counts)}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': buckets,
+        }
+
+
+class Metrics:
+    # Hooks check `metrics.enabled` before doing any work, so instrumentation
+    # costs one attribute lookup per call site while it is turned off
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.sources = {}
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def add_source(self, name, stats):
+        # For components that already keep their own counters, e.g. PWM.stats
+        self.sources[name] = stats
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.gauges.clear()
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'sources': {name: stats() for name, stats in self.sources.items()},
+        }
+
+    async def monitor_loop(self, interval=0.1):
+        # Event-loop lag: how late a timer of known length fires
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            if self.enabled:
+                self.observe('loop.lag', max(0.0, loop.time() - start - interval))
+
+
+def instrumented(name):
+    # Times each call into a histogram; a single flag check while disabled
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+metrics = Metrics()
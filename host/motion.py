@@ -0,0 +1,128 @@
+import array
+import asyncio
+import math
+
+
+CONTROL_RATE = 50  # Hz, as joystick driving
+
+# Worst case, a full 180 degree swing, takes the 0.5 s arms used to be given
+ARM_VELOCITY = 600.0  # Degrees per second
+ARM_ACCELERATION = 3000.0  # Degrees per second squared
+WHEEL_ACCELERATION = 8.0  # Throttle per second: standstill to full speed in 0.125 s
+
+
+class Profile:
+    # Trapezoidal velocity profile: accelerate, cruise, decelerate. Short moves
+    # never reach full speed and make a triangle instead
+    def __init__(self, start, end, velocity=ARM_VELOCITY, acceleration=ARM_ACCELERATION):
+        self.start = start
+        self.end = end
+        self.distance = abs(end - start)
+        self.direction = 1 if end >= start else -1
+        self.acceleration = acceleration
+        self.ramp = velocity / acceleration
+        if self.distance < velocity * self.ramp:
+            self.ramp = math.sqrt(self.distance / acceleration)
+        self.peak = acceleration * self.ramp
+        self.cruise = (self.distance - self.peak * self.ramp) / velocity if self.peak else 0.0
+        self.duration = 2 * self.ramp + self.cruise
+
+    def travelled(self, t):
+        a, ramp, cruise = self.acceleration, self.ramp, self.cruise
+        if t <= 0:
+            return 0.0
+        if t < ramp:
+            return 0.5 * a * t * t
+        if t < ramp + cruise:
+            return 0.5 * a * ramp * ramp + self.peak * (t - ramp)
+        if t < self.duration:
+            left = self.duration - t
+            return self.distance - 0.5 * a * left * left
+        return self.distance
+
+    def sample(self, period):
+        # The whole trajectory at once, one position per control tick, ending on target
+        steps = max(1, math.ceil(self.duration / period))
+        samples = array.array('d', [self.start + self.direction * self.travelled(k * period) for k in range(1, steps + 1)])
+        samples[-1] = self.end
+        return samples
+
+
+def reach(transform):
+    # The arm angles a servo can get to: the inverse of its (linear) transform over
+    # the servo's 0-180 degrees, lowest first
+    offset = transform(0)
+    scale = transform(1) - offset
+    return tuple(sorted(((0 - offset) / scale, (180 - offset) / scale)))
+
+
+def clamp(angle, limits):
+    if limits is None:
+        return angle
+    return min(max(angle, limits[0]), limits[1])
+
+
+def arm_duration(start, end):
+    if start is None:
+        return Profile(0, 180).duration
+    return Profile(start, end).duration
+
+
+def ramp(start, end, period, acceleration=WHEEL_ACCELERATION):
+    # Both wheels change speed over the same ticks, so the robot keeps its heading
+    change = max(abs(e - s) for s, e in zip(start, end))
+    steps = max(1, math.ceil(change / (acceleration * period)))
+    return [tuple(s + (e - s) * k / steps for s, e in zip(start, end)) for k in range(1, steps + 1)]
+
+
+class MotionController:
+    # Steps every moving actuator through its sampled trajectory at the control
+    # rate, all in one PWM batch per tick. It only runs while something moves
+    def __init__(self, pwm, rate=CONTROL_RATE):
+        self.pwm = pwm
+        self.period = 1.0 / rate
+        self.tracks = {}
+        self.task = None
+
+        self.ticks = 0
+        self.motions = 0
+
+    def start(self, actuator, samples, apply):
+        # The first sample goes out now, so a motion starts when it is commanded
+        apply(samples[0])
+        self.motions += 1
+        if len(samples) == 1:
+            self.tracks.pop(actuator, None)
+            return
+        self.tracks[actuator] = [samples, 1, apply]
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def cancel(self, actuator):
+        self.tracks.pop(actuator, None)
+
+    def stop(self):
+        # Everything stays where it has got to
+        self.tracks.clear()
+
+    def moving(self, actuator):
+        return actuator in self.tracks
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while self.tracks:
+            deadline += self.period
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            self.ticks += 1
+            with self.pwm.batch():
+                for actuator, track in list(self.tracks.items()):
+                    samples, index, apply = track
+                    apply(samples[index])
+                    if index + 1 < len(samples):
+                        track[1] = index + 1
+                    else:
+                        del self.tracks[actuator]
+
+    def stats(self):
+        return {'ticks': self.ticks, 'motions': self.motions, 'moving': len(self.tracks)}
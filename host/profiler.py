@@ -0,0 +1,85 @@
+import asyncio
+import os
+import selectors
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+MAX_DEPTH = 64
+
+
+class Profiler:
+    # Samples the event loop thread's stack from a background thread, so the
+    # profiled code runs unmodified; each sample is rooted at the block action
+    # of the task that was running, giving folded stacks for flamegraph.pl or
+    # speedscope. Time waiting in the selector is 'idle' and other loop work,
+    # such as joystick callbacks, is 'loop'
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.target = threading.get_ident()
+        self.loop = None
+        self.actions = {}  # task -> action, as streams run side by side
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def set_action(self, action):
+        # Charges the current task's samples to action, until it sets another
+        task = asyncio.current_task()
+        if action is None:
+            self.actions.pop(task, None)
+        else:
+            self.actions[task] = action
+
+    @contextmanager
+    def label(self, action):
+        previous = self.actions.get(asyncio.current_task())
+        self.set_action(action)
+        try:
+            yield
+        finally:
+            self.set_action(previous)
+
+    def run(self):
+        selector_file = selectors.__file__
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            if frame.f_code.co_filename == selector_file:
+                self.samples[('idle',)] += 1
+                continue
+            action = self.actions.get(asyncio.current_task(self.loop), 'loop')
+            self.samples[(action,) + self.stack(frame)] += 1
+
+    def stack(self, frame):
+        names = []
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return tuple(reversed(names))
+
+    def report(self):
+        samples = list(self.samples.items())
+        actions = Counter()
+        for stack, count in samples:
+            actions[stack[0]] += count
+        return {
+            'interval': self.interval,
+            'samples': sum(actions.values()),
+            'actions': dict(actions),
+            'folded': '\n'.join('%s %d' % (';'.join(stack), count) for stack, count in sorted(samples)),
+        }
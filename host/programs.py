@@ -0,0 +1,98 @@
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+
+class ProgramCache:
+    def __init__(self, size=32, directory=None, compiler=compile, disk_size=256):
+        self.size = size
+        self.disk_size = disk_size
+        self.directory = directory
+        self.compiler = compiler
+        self.programs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, source):
+        key = hashlib.sha256(source.encode()).hexdigest()
+        try:
+            code = self.programs[key]
+        except KeyError:
+            pass
+        else:
+            self.programs.move_to_end(key)
+            self.hits += 1
+            return code
+
+        code = self.load(key)
+        if code is None:
+            self.misses += 1
+            code = self.compiler(source, '<program>', 'exec')
+            self.store(key, code)
+        else:
+            self.hits += 1
+
+        self.programs[key] = code
+        if len(self.programs) > self.size:
+            self.programs.popitem(last=False)
+        return code
+
+    def path(self, key):
+        # Marshalled code objects are only valid for the interpreter that wrote them
+        return os.path.join(self.directory, '%s.%s' % (key, sys.implementation.cache_tag))
+
+    def load(self, key):
+        if not self.directory:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        # Marks it recently used, for evict()
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return code
+
+    def store(self, key, code):
+        if not self.directory:
+            return
+        fd, temp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(code, f)
+            os.replace(temp, self.path(key))
+        except (OSError, ValueError):
+            # The cache only saves compiling again; the program runs all the same
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        # Every edit of a program is a new file, so only the disk_size most
+        # recently used are kept, counting any left by other interpreters
+        try:
+            files = [entry for entry in os.scandir(self.directory) if entry.is_file()]
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+        except OSError:
+            return
+        for entry in files[:max(0, len(files) - self.disk_size)]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.programs)}
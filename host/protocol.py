@@ -0,0 +1,23 @@
+import json
+import struct
+
+
+# Control messages are JSON objects framed by a 4-byte big-endian length
+HEADER = struct.Struct('!I')
+
+
+async def read_message(reader, limit=None):
+    header = await reader.readexactly(HEADER.size)
+    (size,) = HEADER.unpack(header)
+    if limit is not None and size > limit:
+        raise ValueError('Message too large')
+    return json.loads((await reader.readexactly(size)).decode())
+
+
+def encode_message(message):
+    data = json.dumps(message).encode()
+    return HEADER.pack(len(data)) + data
+
+
+def write_message(writer, message):
+    writer.write(encode_message(message))
@@ -0,0 +1,122 @@
+import struct
+from contextlib import contextmanager
+
+
+MODE1_AI = 0x20  # Register auto-increment
+LED0_ON_L = 0x06
+
+
+def registers(duty_cycle):
+    # Same 16-bit to 12-bit mapping as adafruit_pca9685.PWMChannel.duty_cycle
+    if not 0 <= duty_cycle <= 0xFFFF:
+        raise ValueError('Duty cycle out of range: ' + str(duty_cycle))
+    if duty_cycle == 0xFFFF:
+        return struct.pack('<HH', 0x1000, 0)
+    return struct.pack('<HH', 0, (duty_cycle + 1) >> 4)
+
+
+class PWM:
+    def __init__(self, pca, channels=16):
+        self.pca = pca
+        self.frequency = pca.frequency
+        self.shadow = [None] * channels
+        self.dirty = None
+
+        self.writes = 0
+        self.skipped = 0
+        self.transfers = 0
+
+        self.pca.mode1_reg = self.pca.mode1_reg | MODE1_AI
+
+    def set(self, channel, duty_cycle):
+        value = registers(duty_cycle)
+        if self.shadow[channel] == value:
+            self.skipped += 1
+            return
+        self.shadow[channel] = value
+        self.writes += 1
+        if self.dirty is None:
+            self.flush([channel])
+        else:
+            self.dirty.add(channel)
+
+    @contextmanager
+    def batch(self):
+        if self.dirty is not None:
+            yield
+            return
+        self.dirty = set()
+        try:
+            yield
+        finally:
+            dirty, self.dirty = self.dirty, None
+            if dirty:
+                self.flush(dirty)
+
+    def flush(self, channels):
+        # Merge channels into runs of consecutive registers, bridging gaps whose
+        # shadow values are known, so each run is one auto-increment transfer
+        runs = []
+        for channel in sorted(channels):
+            if runs and all(self.shadow[c] is not None for c in range(runs[-1][1] + 1, channel)):
+                runs[-1][1] = channel
+            else:
+                runs.append([channel, channel])
+        for first, last in runs:
+            self.transfer(first, b''.join(self.shadow[first:last + 1]))
+
+    def transfer(self, channel, data):
+        with self.pca.i2c_device as i2c:
+            i2c.write(bytes([LED0_ON_L + 4 * channel]) + data)
+        self.transfers += 1
+
+    def stats(self):
+        return {'writes': self.writes, 'skipped': self.skipped, 'transfers': self.transfers}
+
+
+class Servo:
+    def __init__(self, pwm, channel, min_pulse=750, max_pulse=2250, actuation_range=180):
+        self.pwm = pwm
+        self.channel = channel
+        self.actuation_range = actuation_range
+
+        # Pulse width to duty cycle conversion as done by adafruit_motor.servo
+        self.min_duty = int((min_pulse * pwm.frequency) / 1000000 * 0xFFFF)
+        max_duty = (max_pulse * pwm.frequency) / 1000000 * 0xFFFF
+        self.duty_range = int(max_duty - self.min_duty)
+        self._fraction = None
+
+    @property
+    def fraction(self):
+        return self._fraction
+
+    @fraction.setter
+    def fraction(self, value):
+        if not 0.0 <= value <= 1.0:
+            raise ValueError('Must be 0.0 to 1.0')
+        self._fraction = value
+        self.pwm.set(self.channel, self.min_duty + int(value * self.duty_range))
+
+    @property
+    def angle(self):
+        if self._fraction is None:
+            return None
+        return self._fraction * self.actuation_range
+
+    @angle.setter
+    def angle(self, value):
+        if not 0 <= value <= self.actuation_range:
+            raise ValueError('Angle out of range')
+        self.fraction = value / self.actuation_range
+
+    @property
+    def throttle(self):
+        if self._fraction is None:
+            return None
+        return self._fraction * 2 - 1
+
+    @throttle.setter
+    def throttle(self, value):
+        if not -1.1 <= value <= 1.1:
+            raise ValueError('Throttle must be between -1.0 and 1.0')
+        self.fraction = min(max((value + 1) / 2, 0.0), 1.0)
@@ -1,291 +1,324 @@
+import argparse
 import asyncio
-import subprocess
-
-import busio
-import RPi.GPIO as GPIO
-from board import SCL, SDA
-from adafruit_pca9685 import PCA9685
-
-from control import Wheels, Arm, Light, Speech, Joystick
-
-
-class Routine:
-    def __init__(self, robot):
-        self.action_queue = []
-        self.sync_level = 0
-        self.sync_queue = []
-        self.on_started = []
-        self.on_button = {button : [] for button in ['b1', 'b2', 'b3', 'b4']}
-        self.robot = robot
-
-    def enqueue(self, action):
-        if self.sync_level > 0:
-            self.sync_queue.append(action)
-        else:
-            self.action_queue.append(action)
-
-    def enqueue_synced(self):
-        self.enqueue(asyncio.wait(set(self.sync_queue)))
-        self.sync_queue = []
-
-    async def flush_queue(self):
-        while len(self.action_queue) > 0:
-            coro = self.action_queue.pop(0)
-            await coro
-
-    def in_sync(self):
-        routine = self
-        class SyncTracker:
-            def __enter__(self):
-                routine.sync_level += 1
-            def __exit__(self, type, value, traceback):
-                routine.sync_level -= 1
-                if routine.sync_level == 0:
-                    routine.enqueue_synced()
-        return SyncTracker()
-
-    def wait(self, secs):
-        self.enqueue(asyncio.sleep(secs))
-
-    def say(self, message):
-        self.enqueue(self.robot.speech.synthesize(message))
-
-    def set_antenna_state(self, side, state):
-        if side == 'both':
-            with self.in_sync():
-                self.set_antenna_state('left', state)
-                self.set_antenna_state('right', state)
-            return
-        elif side == 'left':
-            antenna = self.robot.left_antenna
-        elif side == 'right':
-            antenna = self.robot.right_antenna
-        else:
-            raise NameError('No such antenna: ' + side)
-
-        if state == 'on':
-            value = GPIO.HIGH
-        elif state == 'off':
-            value = GPIO.LOW
-        else:
-            raise NameError('No such antenna state: ' + state)
-
-        async def set_antenna_state_async():
-            antenna.set(value)
-        self.enqueue(set_antenna_state_async())
-
-    def set_eye_state(self, side, state):
-        if side == 'both':
-            with self.in_sync():
-                self.set_eye_state('left', state)
-                self.set_eye_state('right', state)
-            return
-        elif side == 'left':
-            eye = self.robot.left_eye
-        elif side == 'right':
-            eye = self.robot.right_eye
-        else:
-            raise NameError('No such eye: ' + side)
-
-        if state == 'on':
-            value = GPIO.HIGH
-        elif state == 'off':
-            value = GPIO.LOW
-        else:
-            raise NameError('No such eye state: ' + state)
-
-        async def set_eye_state_async():
-            eye.set(value)
-        self.enqueue(set_eye_state_async())
-
-    def move_arm(self, side, angle):
-        if side == 'both':
-            with self.in_sync():
-                self.move_arm('left', angle)
-                self.move_arm('right', angle)
+import hmac
+import os
+import time
+
+from control import Wheels, Arm, Light, Speech, Controls
+from drive import Drive
+from events import EventBus
+from hardware import PiBackend, SimulatedBackend
+from metrics import metrics
+from motion import MotionController
+from profiler import Profiler
+from protocol import read_message, write_message
+from pwm import PWM
+from routine import Routine
+from sandbox import Sandbox, ProgramError
+from speechcache import SpeechCache
+from startup import startup, notify
+
+
+STOP_TIMEOUT = 0.5  # How long STOP waits for cancelled actions to unwind
+AUTH_TIMEOUT = 5.0  # How long a TCP client has to send its token
+AUTH_SIZE = 4096  # Largest AUTH message read from a client not yet trusted
+
+
+def load_phrases(path):
+    # Phrases to warm the speech cache with at boot, one per line
+    try:
+        with open(path, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def authenticated(token, handler):
+    # Anyone who can reach a TCP port could otherwise drive the robot, so the
+    # first message must be {"command": "AUTH", "token": ...} with the shared
+    # token, and nothing else is read until it is
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(read_message(reader, AUTH_SIZE), AUTH_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, ConnectionError):
+            request = None
+        given = request.get('token') if isinstance(request, dict) and request.get('command') == 'AUTH' else None
+        if not isinstance(given, str) or not hmac.compare_digest(given.encode(), token.encode()):
+            write_message(writer, {'id': None, 'status': 'ERROR', 'message': 'Not authorized'})
+            writer.close()
             return
-        elif side == 'left':
-            arm = self.robot.left_arm
-        elif side == 'right':
-            arm = self.robot.right_arm
-        else:
-            raise NameError('No such arm: ' + side)
-        
-        async def move_arm_async():
-            arm.move(angle)
-            await asyncio.sleep(0.5)
-        self.enqueue(move_arm_async())
-
-    def roll(self, direction, secs):
-        if direction == 'forward':
-            speed = 1
-        elif direction == 'backward':
-            speed = -1
-        else:
-            raise NameError('No such direction: ' + direction)
-        
-        async def roll_async():
-            self.robot.wheels.go(speed, speed)
-            await asyncio.sleep(secs)
-            self.robot.wheels.stop()
-        self.enqueue(roll_async())
-    
-    def turn(self, direction, secs):
-        if direction == 'clockwise':
-            left, right = 1, -1
-        elif direction == 'counterclockwise':
-            left, right = -1, 1
-        else:
-            raise NameError('No such direction: ' + direction)
-        
-        async def turn_async():
-            self.robot.wheels.go(left, right)
-            await asyncio.sleep(secs)
-            self.robot.wheels.stop()
-        self.enqueue(turn_async())
-
-    def when_started(self, f):
-        async def event_function():
-            f()
-            await self.flush_queue()
-        self.on_started.append(event_function)
-        return event_function
-
-    def when_button_pressed(self, button_number):
-        routine = self
-        def decorator(f_):
-            if not 1 <= button_number <= 4:
-                raise NameError('Button does not exist or cannot be used: ' + str(button_number))
-            button = 'b' + str(button_number)
-            async def event_function():
-                f_()
-                await routine.flush_queue()
-            routine.on_button[button].append(event_function)
-            return event_function
-        return decorator
-
-    async def start(self):
-        for f in self.on_started:
-            await f()
-    
-    async def button(self, button):
-        for f in self.on_button.get(button, []):
-            await f()
+        write_message(writer, {'id': request.get('id'), 'status': 'OK'})
+        await handler(reader, writer)
+    return handle
 
 
 class Robot:
-    def __init__(self, loop):
-        # Set up GPIO for BCM pin number references
-        GPIO.setmode(GPIO.BCM)
+    def __init__(self, loop, backend, data_dir='/home/pi/data'):
+        self.backend = backend
+        self.events = EventBus()
 
         # Initialize the PCA9685 servo controller
-        pca = PCA9685(busio.I2C(SCL, SDA))
-        pca.frequency = 60
+        self.pwm = PWM(backend.pca9685(frequency=60))
+
+        # Wheels and arms move along acceleration-limited trajectories
+        self.motion = MotionController(self.pwm)
 
         # Wheels
-        self.wheels = Wheels(pca, [0, 1, 2, 3])
+        self.wheels = Wheels(self.pwm, [0, 1, 2, 3], self.motion)
 
         # Arms
-        self.left_arm = Arm(pca, 4, lambda t: 90 - t)
-        self.right_arm = Arm(pca, 5, lambda t: 90 + t - 10)
+        self.left_arm = Arm(self.pwm, 4, lambda t: 90 - t, self.motion)
+        self.right_arm = Arm(self.pwm, 5, lambda t: 90 + t - 10, self.motion)
         self.left_arm.move(0)
         self.right_arm.move(0)
 
         # Lights
-        self.left_antenna = Light(26)
-        self.right_antenna = Light(13)
-        self.left_eye = Light(6)
-        self.right_eye = Light(19)
-
-        # Joystick
-        self.joystick = Joystick()
-        self.joystick.register(loop)
-        self.joystick.add_button_callback('start', self.start_button)
-        self.joystick.add_button_callback('select', self.select_button)
-        self.joystick.add_button_callback('b1', self.number_button)
-        self.joystick.add_button_callback('b2', self.number_button)
-        self.joystick.add_button_callback('b3', self.number_button)
-        self.joystick.add_button_callback('b4', self.number_button)
-        self.joystick.add_axis_callback('x', self.joystick_locomote)
-        self.joystick.add_axis_callback('y', self.joystick_locomote)
-
-        # Speech
-        self.speech = Speech('/home/pi/.google-key')
+        self.left_antenna = Light(backend.gpio, 26)
+        self.right_antenna = Light(backend.gpio, 13)
+        self.left_eye = Light(backend.gpio, 6)
+        self.right_eye = Light(backend.gpio, 19)
+
+        # Joysticks, from whichever controllers are plugged in
+        self.controls = Controls()
+        self.controls.add_button_callback('start', self.start_button)
+        self.controls.add_button_callback('select', self.select_button)
+        self.controls.add_button_callback('b1', self.number_button)
+        self.controls.add_button_callback('b2', self.number_button)
+        self.controls.add_button_callback('b3', self.number_button)
+        self.controls.add_button_callback('b4', self.number_button)
+        self.inputs = backend.inputs(self.controls).start(loop)
+
+        # Joystick driving, applied at a fixed control rate
+        self.drive = Drive(self.controls, self.wheels, rate=50, deadband=0.02)
+        self.drive_task = loop.create_task(self.drive.run())
+
+        # Audio and speech; warm_up loads what they need
+        self.audio = backend.audio_player()
+        self.speech = Speech(backend.tts(), SpeechCache(os.path.join(data_dir, 'speech')), self.audio)
+        self.data_dir = data_dir
+
+        # Programs are built into action plans in a separate, resource-limited process
+        self.sandbox = Sandbox(directory=os.path.join(data_dir, 'programs'))
 
         self.routine = None
+        self.profiler = None
+        self.stops = 0
 
         self.active_actions = []
 
+        # Counters the components keep anyway are reported whether or not metrics are enabled
+        metrics.add_source('pwm', self.pwm.stats)
+        metrics.add_source('motion', self.motion.stats)
+        metrics.add_source('drive', self.drive.metrics)
+        metrics.add_source('inputs', self.inputs.stats)
+        metrics.add_source('speech_cache', self.speech.cache.stats)
+        metrics.add_source('sandbox', self.sandbox.stats)
+        metrics.add_source('events', self.events.stats)
+        metrics.add_source('startup', startup.stats)
+        self.monitor_task = loop.create_task(metrics.monitor_loop())
+
+    async def warm_up(self):
+        # What driving does not need, started once the robot is drivable: the
+        # bleep, the sandbox worker, the TTS client and the usual phrases
+        async def speech():
+            await self.speech.tts.connect()
+            self.speech.prefetch(load_phrases(os.path.join(self.data_dir, 'phrases')))
+
+        stages = {'audio': self.audio.load('media/bleep.mp3'), 'sandbox': self.sandbox.warm(), 'speech': speech()}
+        results = await asyncio.gather(*stages.values(), return_exceptions=True)
+        for stage, result in zip(stages, results):
+            if isinstance(result, Exception):
+                # Each loads again on first use, so the robot carries on without it
+                startup.fail(stage, result)
+                self.events.publish('error', message='Could not load %s: %s' % (stage, result))
+        startup.mark('warm')
+
     def start_button(self, joystick, button, state):
         if state == 1:
-            self.stop()
+            asyncio.ensure_future(self.settle(*self.stop()))
 
     def select_button(self, joystick, button, state):
         if state == 1:
-            subprocess.run(['mpg321', 'media/bleep.mp3'])
-            subprocess.run(['sudo', 'poweroff'])
+            asyncio.ensure_future(self.poweroff())
+
+    async def poweroff(self):
+        # The bleep is only a courtesy; without it the robot still powers off
+        try:
+            await self.audio.play_file('media/bleep.mp3')
+        finally:
+            self.backend.poweroff()
     
     def number_button(self, joystick, button, state):
+        if state == 1:
+            self.events.publish('button', button=button)
         if state == 1 and self.routine:
             self.initiate_action(self.routine.button(button))
 
-    def joystick_locomote(self, joystick, axis, state):
-        # Ignore joystick axis inputs when a routine is active
-        if self.routine:
-            return
-
-        x_vector, y_vector = -joystick.axis_states['x'], -joystick.axis_states['y']
-
-        # Motor solutions taken from: http://home.kendra.com/mauser/joystick.html
-        v = y_vector * (2 - abs(x_vector))
-        w = x_vector * (2 - abs(y_vector))
-        L = (v - w) / 2.0
-        R = (v + w) / 2.0
-        self.wheels.go(L, R)
-
     def stop(self):
+        # Motors first and synchronously, before any cancelled task gets to run
+        start = time.perf_counter()
+        self.wheels.stop()
+        self.motion.stop()
+        motors = time.perf_counter() - start
+
         self.routine = None
-        for action in self.active_actions:
+        self.stops += 1
+        self.stop_profiler()
+        tasks = self.cancel_actions()
+        self.drive.resume()
+        return start, motors, tasks
+
+    def cancel_actions(self):
+        self.audio.cancel()
+        self.speech.cancel()
+        tasks = list(self.active_actions)
+        for action in tasks:
             action.cancel()
+        return tasks
+
+    async def settle(self, start, motors, tasks):
+        pending = ()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+        latency = {'motors': motors, 'tasks': time.perf_counter() - start, 'lingering': len(pending)}
+        if metrics.enabled:
+            metrics.observe('stop.motors', latency['motors'])
+            metrics.observe('stop.tasks', latency['tasks'])
+        self.events.publish('stopped', latency=latency)
+        return latency
 
     async def handle_connection(self, reader, writer):
-        recv = await reader.readline()
-        command = recv.decode().strip()
-        if command in ('RUN', 'STOP'):
-            await getattr(self, 'handle_' + command)(reader, writer)
-        else:
-            writer.write('ERROR;No such command'.encode())
-            await writer.drain()
+        # Requests are handled side by side and answered as each completes, so
+        # a STOP never waits behind a RUN's build on a shared connection
+        pending = set()
+        try:
+            while True:
+                try:
+                    request = await read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                except ValueError:
+                    write_message(writer, {'id': None, 'status': 'ERROR', 'message': 'Malformed request'})
+                    continue
+                task = asyncio.ensure_future(self.respond(writer, request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except ConnectionError:
+            pass
+        finally:
+            self.events.unsubscribe(writer)
+            if pending:
+                # Let requests already under way finish, as a RUN changes the robot either way
+                await asyncio.wait(pending)
             writer.close()
-            await writer.wait_closed()
-
-    async def handle_RUN(self, reader, writer):
-        recv = await reader.readline()
-        size = int(recv.decode().strip())
 
-        recv = await reader.read(size)
-        code = recv.decode()
-
-        self.routine = Routine(self)
-        try:
-            exec(code, {'robot': self.routine})
-        except Exception as e:
-            writer.write(('ERROR;' + str(e)).encode())
-            self.routine = None
+    async def respond(self, writer, request):
+        if not isinstance(request, dict):
+            response = {'status': 'ERROR', 'message': 'Malformed request'}
+            request = {}
+        elif request.get('command') == 'SUBSCRIBE':
+            self.events.subscribe(writer)
+            response = {'status': 'OK'}
         else:
-            self.initiate_action(self.routine.flush_queue())
-            self.initiate_action(self.routine.start())
-            writer.write('OK'.encode())
+            try:
+                response = await self.handle_request(request)
+            except Exception as e:
+                # Only this request fails; the connection may be shared by many clients
+                response = {'status': 'ERROR', 'message': 'Internal error: %s' % e}
+        response['id'] = request.get('id')
+        if writer.is_closing():
+            return
+        write_message(writer, response)
+        try:
             await writer.drain()
-        writer.close()
-        await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def handle_request(self, request):
+        command = request.get('command')
+        if command in ('RUN', 'STOP', 'STATS', 'PROFILE'):
+            return await getattr(self, 'handle_' + command)(request)
+        else:
+            return {'status': 'ERROR', 'message': 'No such command'}
 
-    async def handle_STOP(self, reader, writer):
-        self.stop()
-        writer.write('OK'.encode())
-        await writer.drain()
-        writer.close()
-        await writer.wait_closed()
+    async def handle_RUN(self, request):
+        stops = self.stops
+        try:
+            plan = await self.sandbox.build(request.get('program', ''))
+        except ProgramError as e:
+            if not request.get('dry_run'):
+                self.events.publish('error', message=str(e))
+            return {'status': 'ERROR', 'message': str(e)}
+        if stops != self.stops and not request.get('dry_run'):
+            return {'status': 'ERROR', 'message': 'Stopped while building'}
+
+        # Once nothing of the routine is left running there is no position to
+        # keep, and a reload is an ordinary run
+        if request.get('reload') and self.routine is not None and self.routine.runs and not request.get('dry_run'):
+            return self.reload(plan)
+
+        routine = Routine.from_plan(self, plan)
+        if request.get('dry_run'):
+            return dict(await routine.dry_run(), status='OK')
+
+        if request.get('profile'):
+            # Replaces any earlier profile; it runs until STOP or the next RUN
+            self.stop_profiler()
+            self.profiler = routine.profiler = Profiler(request.get('interval', 0.01)).start()
+
+        # Anything left of the previous routine would fight this one for the hardware
+        if self.active_actions:
+            self.wheels.stop()
+            self.cancel_actions()
+        self.routine = routine
+        self.routine.prefetch()
+
+        # Ignore joystick axis inputs while a routine is active
+        self.drive.pause()
+        when = request.get('start_at')
+        for start in [routine.flush_queue] + routine.starters():
+            self.initiate_action(start() if when is None else self.start_at(when, start))
+        self.events.publish('started', start_at=when)
+        return {'status': 'OK'}
+
+    def reload(self, plan):
+        # While tuning a program, only the edit runs: the routine keeps its place
+        # rather than replaying everything before it
+        started = self.routine.reload(plan)
+        self.routine.prefetch()
+        self.drive.pause()
+        for coro in started:
+            self.initiate_action(coro)
+        self.events.publish('reloaded', changed=len(started))
+        return {'status': 'OK', 'changed': len(started)}
+
+    async def start_at(self, when, start):
+        # Fleet runs start together at a wall-clock time, given NTP-synced robots
+        await asyncio.sleep(max(0.0, when - time.time()))
+        await start()
+
+    async def handle_STOP(self, request):
+        latency = await self.settle(*self.stop())
+        return {'status': 'OK', 'latency': latency}
+
+    async def handle_STATS(self, request):
+        if 'enable' in request:
+            metrics.enabled = bool(request['enable'])
+        if request.get('reset'):
+            metrics.reset()
+        return {'status': 'OK', 'stats': metrics.snapshot()}
+
+    async def handle_PROFILE(self, request):
+        if self.profiler is None:
+            return {'status': 'ERROR', 'message': 'No profile recorded'}
+        if request.get('stop'):
+            self.stop_profiler()
+        return dict(self.profiler.report(), status='OK')
+
+    def stop_profiler(self):
+        # The report stays available to PROFILE until the next profiled RUN
+        if self.profiler is not None:
+            self.profiler.stop()
 
     def initiate_action(self, coro):
         action = asyncio.create_task(coro)
@@ -295,16 +328,52 @@ class Robot:
     def complete_action(self, action):
         if action in self.active_actions:
             self.active_actions.remove(action)
+        if action.cancelled():
+            return
+        if action.exception() is not None:
+            self.events.publish('error', message=str(action.exception()))
+        elif not self.active_actions and self.routine is not None:
+            self.events.publish('finished')
 
 
-async def main():
+async def main(args):
+    # Staged so the robot can be driven as soon as possible after power-on
+    startup.mark('imports')
     loop = asyncio.get_event_loop()
-    robot = Robot(loop)
-
-    server = await asyncio.start_unix_server(robot.handle_connection, '/tmp/robot-control')
-    async with server:
-        await server.serve_forever()
+    backend = SimulatedBackend(input_dir=os.path.join(args.data, 'input')) if args.simulate else PiBackend()
+    metrics.enabled = args.metrics
+    robot = Robot(loop, backend, data_dir=args.data)
+    startup.mark('hardware')
+
+    servers = [await asyncio.start_unix_server(robot.handle_connection, args.socket)]
+    if args.tcp:
+        # So one web server can drive a fleet of robots over the network
+        host, _, port = args.tcp.rpartition(':')
+        servers.append(await asyncio.start_server(authenticated(args.token, robot.handle_connection),
+                                                  host or None, int(port)))
+    startup.mark('listening')
+    notify('READY=1\nSTATUS=Drivable, loading speech and sandbox')
+
+    await robot.warm_up()
+    notify('STATUS=Ready')
+    try:
+        await asyncio.gather(*[server.serve_forever() for server in servers])
+    finally:
+        if args.simulate:
+            backend.close()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--simulate', action='store_true', help='run against simulated hardware')
+    parser.add_argument('--socket', default='/tmp/robot-control')
+    parser.add_argument('--data', default='/home/pi/data')
+    parser.add_argument('--tcp', metavar='[HOST]:PORT',
+                        help='also accept control connections over TCP, from clients that send the '
+                             'shared token in $ROBOT_TOKEN; without HOST it listens on every interface')
+    parser.add_argument('--metrics', action='store_true', help='record latency histograms from startup')
+    args = parser.parse_args()
+    args.token = os.environ.get('ROBOT_TOKEN')
+    if args.tcp and not args.token:
+        parser.error('--tcp needs a shared token in ROBOT_TOKEN')
+    asyncio.run(main(args))
@@ -0,0 +1,287 @@
+import asyncio
+import functools
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from metrics import metrics
+from scheduler import Scheduler
+from timeline import Timeline, Executor, RobotTarget, RecordingTarget, SimulatedClock, resources
+
+
+# Light states, as RPi.GPIO.HIGH and RPi.GPIO.LOW
+HIGH = 1
+LOW = 0
+
+
+def streams(plan):
+    keyed = {'actions': plan['actions']}
+    for i, actions in enumerate(plan['started']):
+        keyed['started.%d' % i] = actions
+    return keyed
+
+
+class Routine:
+    def __init__(self, robot):
+        self.actions = Scheduler()
+        # Where enqueued actions go: top-level code fills self.actions and each
+        # handler invocation gets a stream of its own
+        self.stream = self.actions
+        self.locks = {}
+        self.sync_level = 0
+        self.sync_queue = []
+        self.on_started = []
+        self.on_button = {button : [] for button in ['b1', 'b2', 'b3', 'b4']}
+        self.phrases = []
+        self.robot = robot
+        self.profiler = None
+        # Plan actions of each top-level or started stream, and the run of any
+        # still going, by key; what an incremental reload diffs against
+        self.streams = {}
+        self.runs = {}
+
+    @classmethod
+    def from_plan(cls, robot, plan):
+        # Rebuilds a routine from what sandbox.build recorded of the program
+        routine = cls(robot)
+        routine.replay(plan['actions'])
+        routine.load(plan)
+        return routine
+
+    def load(self, plan):
+        self.on_started = [functools.partial(self.replay, actions) for actions in plan['started']]
+        self.on_button = {button : [] for button in self.on_button}
+        for button, handlers in plan['buttons'].items():
+            self.on_button[button] = [functools.partial(self.replay, actions) for actions in handlers]
+        self.phrases = list(plan['phrases'])
+        self.streams = streams(plan)
+
+    def reload(self, plan):
+        # Swaps a new build of the program in without starting over. Streams the
+        # edit left alone keep running untouched, changed ones carry on with
+        # their new actions from the position they had reached and new ones start.
+        # Button handlers are replaced for the next press. Returns coroutines
+        # running the changed streams, for the robot to initiate
+        previous = self.streams
+        self.load(plan)
+        started = []
+        for key in previous.keys() - self.streams.keys():
+            if key in self.runs:
+                self.runs.pop(key)[1].cancel()
+        for key, actions in self.streams.items():
+            if key not in previous:
+                started.append(self.run_actions(actions, key))
+            elif actions != previous[key] and key in self.runs:
+                executor, task = self.runs.pop(key)
+                offset, speeches = executor.handover()
+                task.cancel()
+                # Timed from the same arm angles as the run it takes over
+                arms = executor.timeline.start_arms if executor.timeline is not None else None
+                started.append(self.run_actions(actions, key, offset, speeches, arms))
+        return started
+
+    def replay(self, actions):
+        for name, args in actions:
+            self.enqueue(name, *args)
+
+    def enqueue(self, name, *args):
+        if self.sync_level > 0:
+            self.sync_queue.append((name, args))
+        else:
+            self.stream.push(name, *args)
+
+    def enqueue_synced(self):
+        self.enqueue('sync', *self.sync_queue)
+        self.sync_queue = []
+
+    def new_timeline(self, arms=None):
+        if arms is None:
+            arms = {'left': self.robot.left_arm.position, 'right': self.robot.right_arm.position}
+        limits = {'left': self.robot.left_arm.limits, 'right': self.robot.right_arm.limits}
+        return Timeline(estimate=self.robot.speech.estimate, arms=arms, limits=limits)
+
+    async def flush_queue(self):
+        await self.flush(self.actions, 'actions')
+
+    async def flush(self, stream, key=None):
+        while len(stream) > 0:
+            if metrics.enabled:
+                metrics.gauge('routine.queue_depth', len(stream))
+            await self.run_actions(stream.take(), key)
+
+    async def run_actions(self, actions, key=None, offset=0.0, speeches=None, arms=None):
+        executor = Executor(RobotTarget(self.robot), profiler=self.profiler, on_action=self.action_started)
+        if key is not None:
+            self.runs[key] = (executor, asyncio.current_task())
+        try:
+            async with self.lock(resources(actions)):
+                # Compiled once the arms are ours, as arm moves last as long as
+                # the trajectory from where the arm is now
+                timeline = self.new_timeline(arms)
+                timeline.add(actions)
+                await executor.run(timeline, offset, speeches)
+        finally:
+            if key is not None and self.runs.get(key, (None,))[0] is executor:
+                del self.runs[key]
+
+    def action_started(self, action):
+        self.robot.events.publish('action', action=action)
+
+    @asynccontextmanager
+    async def lock(self, names):
+        # Streams touching disjoint hardware overlap; ones sharing any of it take
+        # turns. Locks are always taken in sorted order, so streams cannot deadlock
+        async with AsyncExitStack() as stack:
+            for name in sorted(names):
+                if name not in self.locks:
+                    self.locks[name] = asyncio.Lock()
+                await stack.enter_async_context(self.locks[name])
+            yield
+
+    def in_sync(self):
+        routine = self
+        class SyncTracker:
+            def __enter__(self):
+                routine.sync_level += 1
+            def __exit__(self, type, value, traceback):
+                routine.sync_level -= 1
+                if routine.sync_level == 0:
+                    routine.enqueue_synced()
+        return SyncTracker()
+
+    def wait(self, secs):
+        self.enqueue('wait', secs)
+
+    def say(self, message):
+        self.phrases.append(message)
+        self.enqueue('say', message)
+
+    def prefetch(self):
+        self.robot.speech.prefetch(self.phrases)
+        self.phrases = []
+
+    def set_antenna_state(self, side, state):
+        if side == 'both':
+            with self.in_sync():
+                self.set_antenna_state('left', state)
+                self.set_antenna_state('right', state)
+            return
+        elif side not in ('left', 'right'):
+            raise NameError('No such antenna: ' + side)
+
+        if state == 'on':
+            value = HIGH
+        elif state == 'off':
+            value = LOW
+        else:
+            raise NameError('No such antenna state: ' + state)
+
+        self.enqueue('set_antenna_state', side, value)
+
+    def set_eye_state(self, side, state):
+        if side == 'both':
+            with self.in_sync():
+                self.set_eye_state('left', state)
+                self.set_eye_state('right', state)
+            return
+        elif side not in ('left', 'right'):
+            raise NameError('No such eye: ' + side)
+
+        if state == 'on':
+            value = HIGH
+        elif state == 'off':
+            value = LOW
+        else:
+            raise NameError('No such eye state: ' + state)
+
+        self.enqueue('set_eye_state', side, value)
+
+    def move_arm(self, side, angle):
+        if side == 'both':
+            with self.in_sync():
+                self.move_arm('left', angle)
+                self.move_arm('right', angle)
+            return
+        elif side not in ('left', 'right'):
+            raise NameError('No such arm: ' + side)
+
+        self.enqueue('move_arm', side, angle)
+
+    def roll(self, direction, secs):
+        if direction == 'forward':
+            speed = 1
+        elif direction == 'backward':
+            speed = -1
+        else:
+            raise NameError('No such direction: ' + direction)
+
+        self.enqueue('roll', speed, speed, secs)
+    
+    def turn(self, direction, secs):
+        if direction == 'clockwise':
+            left, right = 1, -1
+        elif direction == 'counterclockwise':
+            left, right = -1, 1
+        else:
+            raise NameError('No such direction: ' + direction)
+
+        self.enqueue('turn', left, right, secs)
+
+    def when_started(self, f):
+        self.on_started.append(f)
+        return f
+
+    def when_button_pressed(self, button_number):
+        routine = self
+        def decorator(f_):
+            if not 1 <= button_number <= 4:
+                raise NameError('Button does not exist or cannot be used: ' + str(button_number))
+            button = 'b' + str(button_number)
+            routine.on_button[button].append(f_)
+            return f_
+        return decorator
+
+    def collect(self, f):
+        # Handler bodies only enqueue, so they run to completion before anything else
+        stream, self.stream = self.stream, Scheduler()
+        try:
+            if self.profiler is not None:
+                with self.profiler.label('handler'):
+                    f()
+            else:
+                f()
+            return self.stream
+        finally:
+            self.stream = stream
+
+    async def handle_event(self, f, key=None):
+        stream = self.collect(f)
+        self.prefetch()
+        await self.flush(stream, key)
+
+    def starters(self):
+        # One per started handler, each for the robot to run as an action of its
+        # own, so reloading one handler's stream leaves the others tracked for STOP
+        return [functools.partial(self.handle_event, f, 'started.%d' % i) for i, f in enumerate(self.on_started)]
+
+    async def button(self, button):
+        await asyncio.gather(*[self.handle_event(f) for f in self.on_button.get(button, [])])
+
+    def plan(self):
+        # Top-level actions and each started handler run side by side, as in
+        # handle_RUN, with a stream waiting for any hardware an earlier one holds
+        timeline = self.new_timeline()
+        free = {}
+        streams = [self.actions] + [self.collect(f) for f in self.on_started]
+        for stream in streams:
+            actions = stream.take()
+            used = resources(actions)
+            end = timeline.add(actions, start=max([free.get(name, 0) for name in used], default=0))
+            for name in used:
+                free[name] = end
+        return timeline
+
+    async def dry_run(self):
+        timeline = self.plan()
+        clock = SimulatedClock()
+        target = RecordingTarget(clock)
+        await Executor(target, clock).run(timeline)
+        return {'duration': timeline.duration, 'commands': target.log}
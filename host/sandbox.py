@@ -0,0 +1,261 @@
+import ast
+import asyncio
+import builtins
+import math
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from programs import ProgramCache
+from routine import Routine
+
+
+CPU_SECONDS = 2
+MEMORY_BYTES = 256 * 1024 * 1024
+MAX_ACTIONS = 100000
+MAX_ANGLE = 360  # Blockly's angle field goes to 360; arms clamp to what they reach
+
+# Part of the program cache's directory, so code compiled under older rules is
+# never loaded; bump it whenever validate() changes
+VALIDATOR_VERSION = 1
+
+# The Routine methods programs may call
+API = ['say', 'wait', 'move_arm', 'roll', 'turn', 'set_antenna_state', 'set_eye_state',
+       'in_sync', 'when_started', 'when_button_pressed']
+
+# Enough Python for what the blocks generate, plus plain loops, arithmetic and
+# variables for hand-written programs; no imports, classes, lambdas or comprehensions
+ALLOWED_NODES = {
+    ast.Module, ast.Expr, ast.Pass, ast.Break, ast.Continue,
+    ast.FunctionDef, ast.arguments, ast.arg, ast.Return, ast.Global,
+    ast.Assign, ast.AugAssign, ast.If, ast.For, ast.While, ast.With, ast.withitem,
+    ast.Call, ast.keyword, ast.Attribute, ast.Name, ast.Load, ast.Store, ast.Constant,
+    ast.List, ast.Tuple, ast.Subscript, ast.Slice, ast.IfExp,
+    ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+}
+
+SAFE_BUILTINS = {name: getattr(builtins, name) for name in [
+    'abs', 'bool', 'enumerate', 'float', 'int', 'len', 'max', 'min', 'range',
+    'reversed', 'round', 'str', 'sum', 'zip', 'True', 'False', 'None',
+]}
+
+
+class ProgramError(Exception):
+    pass
+
+
+class RobotAPI:
+    # All of the Routine a program gets to see, so it cannot enqueue actions
+    # past the argument checks in the block methods
+    def __init__(self, routine):
+        for name in API:
+            setattr(self, name, getattr(routine, name))
+
+
+def number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def duration(value):
+    return number(value) and value >= 0
+
+
+def speed(value):
+    return number(value) and -1 <= value <= 1
+
+
+def angle(value):
+    return number(value) and -MAX_ANGLE <= value <= MAX_ANGLE
+
+
+def side(value):
+    return value in ('left', 'right')
+
+
+def level(value):
+    return value in (0, 1)
+
+
+def text(value):
+    return isinstance(value, str)
+
+
+# What each action's arguments must be, as the Routine methods enqueue them
+ACTION_ARGS = {
+    'wait': (duration,),
+    'say': (text,),
+    'move_arm': (side, angle),
+    'roll': (speed, speed, duration),
+    'turn': (speed, speed, duration),
+    'set_antenna_state': (side, level),
+    'set_eye_state': (side, level),
+}
+
+
+def check_actions(actions):
+    for name, args in actions:
+        if name == 'sync':
+            check_actions(args)
+            continue
+        checks = ACTION_ARGS.get(name)
+        if checks is None:
+            raise ProgramError('No such action: ' + str(name))
+        if len(args) != len(checks) or not all(check(arg) for check, arg in zip(checks, args)):
+            raise ProgramError('Bad arguments to %s: %s' % (name, ', '.join(map(repr, args))))
+
+
+def check_plan(plan):
+    # Run on the host, so nothing the worker sends back reaches the executor unchecked
+    try:
+        check_actions(plan['actions'])
+        for actions in plan['started']:
+            check_actions(actions)
+        for button, handlers in plan['buttons'].items():
+            if button not in ('b1', 'b2', 'b3', 'b4'):
+                raise ProgramError('No such button: ' + str(button))
+            for actions in handlers:
+                check_actions(actions)
+        if not all(text(phrase) for phrase in plan['phrases']):
+            raise ProgramError('Phrases must be text')
+    except (KeyError, TypeError, ValueError, RecursionError):
+        raise ProgramError('Malformed action plan') from None
+
+
+def validate(tree):
+    for node in ast.walk(tree):
+        if type(node) not in ALLOWED_NODES:
+            raise ProgramError('Not allowed in programs: ' + type(node).__name__)
+        if isinstance(node, ast.Attribute) and node.attr.startswith('_'):
+            raise ProgramError('No such attribute: ' + node.attr)
+        if isinstance(node, ast.Name) and node.id.startswith('_'):
+            raise ProgramError('No such name: ' + node.id)
+
+
+def checked_compile(source, filename, mode):
+    tree = ast.parse(source, filename, mode)
+    validate(tree)
+    return compile(tree, filename, mode)
+
+
+# Worker process state, set up by initialize()
+cache = None
+
+
+def initialize(directory):
+    global cache
+    resource.setrlimit(resource.RLIMIT_AS, (MEMORY_BYTES, MEMORY_BYTES))
+    if directory:
+        directory = os.path.join(directory, 'checked-%d' % VALIDATOR_VERSION)
+    cache = ProgramCache(directory=directory, compiler=checked_compile)
+
+
+def build(source):
+    # RLIMIT_CPU counts the worker's whole life, so each build gets a fresh allowance
+    # on top of what has been used; going over kills the worker with SIGXCPU
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (int(usage.ru_utime + usage.ru_stime) + CPU_SECONDS, hard))
+
+    routine = Routine(None)
+    try:
+        exec(cache.get(source), {'robot': RobotAPI(routine), '__builtins__': SAFE_BUILTINS})
+        plan = {
+            'actions': routine.actions.take(),
+            'started': [routine.collect(f).take() for f in routine.on_started],
+            'buttons': {button: [routine.collect(f).take() for f in handlers]
+                        for button, handlers in routine.on_button.items() if handlers},
+            'phrases': routine.phrases,
+        }
+    except ProgramError:
+        raise
+    except MemoryError:
+        raise ProgramError('Program used too much memory') from None
+    except Exception as e:
+        raise ProgramError(str(e)) from None
+
+    if count(plan) > MAX_ACTIONS:
+        raise ProgramError('Program has too many actions')
+    # The cache lives in the worker, so its counts come back with each plan
+    return plan, dict(cache.stats(), worker=os.getpid())
+
+
+def count(plan):
+    return (len(plan['actions']) + sum(len(actions) for actions in plan['started'])
+            + sum(len(actions) for handlers in plan['buttons'].values() for actions in handlers))
+
+
+class Sandbox:
+    # Programs are executed in a worker process with CPU and memory limits, and
+    # only the resulting action plan comes back, so user code never runs on
+    # the event loop that handles the joystick and STOP
+    def __init__(self, directory=None, workers=1):
+        self.directory = directory
+        self.workers = workers
+        self.pool = None
+
+        self.builds = 0
+        self.failures = 0
+        self.restarts = 0
+        self.build_time = 0.0
+        # Program cache counts as last reported by each worker process
+        self.programs = {}
+
+    def start(self):
+        # forkserver, because forking the host would copy its event loop and threads
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('forkserver'),
+                                        initializer=initialize, initargs=(self.directory,))
+        return self.pool
+
+    async def warm(self):
+        # Start the worker now rather than on the first RUN. Submitting spawns the
+        # forkserver and worker, which blocks for a while, so it is done in a thread
+        pool = self.pool or self.start()
+        await asyncio.wrap_future(await asyncio.to_thread(pool.submit, build, ''))
+
+    async def build(self, source):
+        if self.pool is None:
+            self.start()
+        start = time.perf_counter()
+        self.builds += 1
+        try:
+            plan, programs = await asyncio.get_running_loop().run_in_executor(self.pool, build, source)
+            self.programs[programs.pop('worker')] = programs
+            check_plan(plan)
+            return plan
+        except BrokenProcessPool:
+            self.failures += 1
+            self.restarts += 1
+            self.pool.shutdown(wait=False)
+            self.pool = None
+            # The dead worker's counts stand, but its cached programs are gone
+            for programs in self.programs.values():
+                programs['size'] = 0
+            raise ProgramError('Program exceeded its time or memory limit') from None
+        except ProgramError:
+            self.failures += 1
+            raise
+        finally:
+            self.build_time += time.perf_counter() - start
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def stats(self):
+        return {
+            'builds': self.builds,
+            'failures': self.failures,
+            'restarts': self.restarts,
+            'build_time_mean': self.build_time / self.builds if self.builds else 0.0,
+            'programs': {
+                'hits': sum(programs['hits'] for programs in self.programs.values()),
+                'misses': sum(programs['misses'] for programs in self.programs.values()),
+                'size': sum(programs['size'] for programs in self.programs.values()),
+            },
+        }
@@ -0,0 +1,22 @@
+from collections import deque
+
+
+class Scheduler:
+    def __init__(self):
+        # Actions are stored as (name, args) descriptors and only turned into
+        # hardware commands when they are compiled into a Timeline
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, name, *args):
+        self.queue.append((name, args))
+
+    def take(self):
+        actions = list(self.queue)
+        self.queue.clear()
+        return actions
+
+    def clear(self):
+        self.queue.clear()
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+
+class SpeechCache:
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(directory, 'index.json')
+
+        # key -> {'text', 'size'}, least recently used first
+        self.entries = OrderedDict()
+        self.total = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.load_index()
+
+    def key(self, text, config):
+        return hashlib.sha1(json.dumps([config, text]).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.audio')
+
+    def get(self, key):
+        # Recency is only persisted with the next put() so hits never touch the disk
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.path(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, text, audio):
+        self.write(self.path(key), audio)
+        if key in self.entries:
+            self.total -= self.entries.pop(key)['size']
+        self.entries[key] = {'text': text, 'size': len(audio)}
+        self.total += len(audio)
+        self.evict()
+        self.save_index()
+        return self.path(key)
+
+    def evict(self):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            self.total -= entry['size']
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def write(self, path, data):
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            os.remove(temp)
+            raise
+
+    def load_index(self):
+        try:
+            with open(self.index_file) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+
+        for key, entry in entries:
+            if os.path.exists(self.path(key)):
+                self.entries[key] = entry
+                self.total += entry['size']
+
+        # Drop audio files the index does not know about, e.g. from an interrupted write
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if name != 'index.json' and (ext != '.audio' or key not in self.entries):
+                os.remove(os.path.join(self.directory, name))
+
+        self.evict()
+
+    def save_index(self):
+        self.write(self.index_file, json.dumps(list(self.entries.items())).encode())
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.total,
+        }
@@ -0,0 +1,53 @@
+import os
+import socket
+import time
+
+
+def since_boot():
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+def process_started():
+    # Field 22 of /proc/self/stat, in clock ticks since boot; the command name
+    # before it is in parentheses and may contain spaces
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rpartition(')')[2].split()
+        return int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return since_boot()
+
+
+class Startup:
+    # When each stage of bringing the host up finished, in seconds since the
+    # process started, so time-to-drivable after power-on can be measured and cut
+    def __init__(self):
+        self.started = process_started()
+        self.stages = {}
+        self.failures = {}
+
+    def mark(self, stage):
+        self.stages[stage] = since_boot() - self.started
+
+    def fail(self, stage, error):
+        self.failures[stage] = str(error)
+
+    def stats(self):
+        return dict(self.stages, process_started=self.started, failures=len(self.failures))
+
+
+def notify(state):
+    # sd_notify(3) without libsystemd: one datagram to $NOTIFY_SOCKET, when
+    # running under a Type=notify unit
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC) as sock:
+        sock.connect(address)
+        sock.sendall(state.encode())
+    return True
+
+
+startup = Startup()
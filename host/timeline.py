@@ -0,0 +1,270 @@
+import asyncio
+
+from metrics import metrics
+from motion import arm_duration, clamp
+
+
+SPEECH_RATE = 0.07  # Seconds per character when the audio length is not known yet
+
+
+def estimate_speech(message):
+    return SPEECH_RATE * len(message)
+
+
+def resources(actions):
+    # Hardware each action needs to itself while it runs
+    used = set()
+    for name, args in actions:
+        if name == 'sync':
+            used |= resources(args)
+        elif name in ('roll', 'turn'):
+            used.add('wheels')
+        elif name == 'move_arm':
+            used.add(args[0] + '_arm')
+        elif name == 'set_antenna_state':
+            used.add(args[0] + '_antenna')
+        elif name == 'set_eye_state':
+            used.add(args[0] + '_eye')
+        elif name == 'say':
+            used.add('speech')
+    return used
+
+
+class Timeline:
+    def __init__(self, estimate=estimate_speech, arms=None, limits=None):
+        # (time, sequence, command, args, action); sequence keeps same-time commands
+        # in program order and action names the block action that emitted the command
+        self.events = []
+        self.duration = 0.0
+        self.estimate = estimate
+        self.speeches = 0
+        self.action = None
+        # Arm angles as the timeline starts, where known, and as its moves leave them;
+        # a move lasts as long as its trajectory from the previous angle
+        self.start_arms = dict(arms or {})
+        self.arms = dict(self.start_arms)
+        # Each arm's reachable angles, by side; moves go no further, as in Arm.move
+        self.limits = dict(limits or {})
+
+    def at(self, time, command, *args):
+        self.events.append((time, len(self.events), command, args, self.action))
+
+    def add(self, actions, start=None):
+        time = self.duration if start is None else start
+        for name, args in actions:
+            time = self.add_action(name, args, time)
+        self.duration = max(self.duration, time)
+        return time
+
+    def add_action(self, name, args, time):
+        if name == 'sync':
+            return max([self.add_action(n, a, time) for n, a in args], default=time)
+        self.action = name
+        if name == 'wait':
+            (secs,) = args
+            return time + secs
+        elif name in ('roll', 'turn'):
+            left, right, secs = args
+            self.at(time, 'drive', left, right)
+            self.at(time + secs, 'halt')
+            return time + secs
+        elif name == 'move_arm':
+            side, angle = args
+            angle = clamp(angle, self.limits.get(side))
+            self.at(time, 'arm', side, angle)
+            duration = arm_duration(self.arms.get(side), angle)
+            self.arms[side] = angle
+            return time + duration
+        elif name == 'set_antenna_state':
+            side, value = args
+            self.at(time, 'light', side + '_antenna', value)
+            return time
+        elif name == 'set_eye_state':
+            side, value = args
+            self.at(time, 'light', side + '_eye', value)
+            return time
+        elif name == 'say':
+            # Speech length is only known once it plays, so it starts at its slot
+            # and is joined at its estimated end; any overrun shifts what follows
+            (message,) = args
+            handle = self.speeches
+            self.speeches += 1
+            end = time + self.estimate(message)
+            self.at(time, 'say', handle, message)
+            self.at(end, 'join', handle)
+            return end
+        else:
+            raise NameError('No such action: ' + name)
+
+    def commands(self):
+        return [(time, command, args) for time, _, command, args, _ in sorted(self.events)]
+
+    def schedule(self):
+        return [(time, command, args, action) for time, _, command, args, action in sorted(self.events)]
+
+
+class MonotonicClock:
+    def now(self):
+        return asyncio.get_running_loop().time()
+
+    async def sleep_until(self, deadline):
+        delay = deadline - self.now()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def now(self):
+        return self.time
+
+    async def sleep_until(self, deadline):
+        self.time = max(self.time, deadline)
+
+
+class RobotTarget:
+    def __init__(self, robot):
+        self.robot = robot
+
+    def drive(self, left, right):
+        self.robot.wheels.go(left, right)
+
+    def halt(self):
+        self.robot.wheels.go(0, 0)
+
+    def arm(self, side, angle):
+        getattr(self.robot, side + '_arm').move(angle)
+
+    def light(self, name, value):
+        getattr(self.robot, name).set(value)
+
+    async def say(self, message):
+        await self.robot.speech.synthesize(message)
+
+
+class RecordingTarget:
+    def __init__(self, clock):
+        self.clock = clock
+        self.log = []
+
+    def record(self, command, *args):
+        self.log.append((self.clock.now(), command, args))
+
+    def drive(self, left, right):
+        self.record('drive', left, right)
+
+    def halt(self):
+        self.record('halt')
+
+    def arm(self, side, angle):
+        self.record('arm', side, angle)
+
+    def light(self, name, value):
+        self.record('light', name, value)
+
+    def say(self, message):
+        # Recorded when issued rather than when a task gets round to it
+        self.record('say', message)
+        done = asyncio.get_running_loop().create_future()
+        done.set_result(None)
+        return done
+
+
+class Executor:
+    def __init__(self, target, clock=None, profiler=None, on_action=None):
+        self.target = target
+        self.clock = clock or MonotonicClock()
+        self.profiler = profiler
+        self.on_action = on_action
+        self.timeline = None
+        self.start = None
+        self.shift = 0.0
+        self.joining = None
+        self.speeches = {}
+        self.handing_over = False
+
+    def position(self):
+        # How far into its timeline the run has got, not counting speech overruns
+        if self.start is None:
+            return 0.0
+        if self.joining is not None:
+            return self.joining
+        return self.clock.now() - self.start - self.shift
+
+    def handover(self):
+        # Leaves the hardware and any speech as they are for a run taking over
+        # from position(); the caller then cancels the task awaiting run()
+        self.handing_over = True
+        return self.position(), self.speeches
+
+    def catch_up(self, events):
+        # Sets the hardware to where the skipped events leave it. They match what
+        # already ran up to an edit, so mostly this rewrites unchanged values
+        state = {}
+        for time, command, args, action in events:
+            if command in ('drive', 'halt'):
+                state['wheels'] = (command, args)
+            elif command in ('arm', 'light'):
+                state[command, args[0]] = (command, args)
+        for command, args in state.values():
+            getattr(self.target, command)(*args)
+        return state.get('wheels', ('halt',))[0] == 'drive'
+
+    async def run(self, timeline, offset=0.0, speeches=None):
+        clock, target, profiler = self.clock, self.target, self.profiler
+        self.timeline = timeline
+        self.start = start = clock.now() - offset
+        self.shift = 0.0
+        self.speeches = speeches = dict(speeches or {})
+        schedule = timeline.schedule()
+        skipped = [event for event in schedule if event[0] < offset]
+        driving = self.catch_up(skipped) if skipped else False
+        current = None
+        try:
+            for time, command, args, action in schedule[len(skipped):]:
+                # Deadlines are absolute, so time spent applying commands never accumulates
+                deadline = start + self.shift + time
+                await clock.sleep_until(deadline)
+                if metrics.enabled:
+                    metrics.observe('executor.lateness', max(0.0, clock.now() - deadline))
+                    metrics.count('executor.' + command)
+                if profiler is not None:
+                    # Until the next command, this task's samples are charged to this command's action
+                    profiler.set_action(action)
+                if self.on_action is not None and command not in ('halt', 'join') and action != current:
+                    current = action
+                    self.on_action(action)
+                if command == 'say':
+                    handle, message = args
+                    speeches[handle] = asyncio.ensure_future(target.say(message))
+                elif command == 'join':
+                    if args[0] not in speeches:
+                        continue  # Said and finished before a handover
+                    self.joining = time
+                    try:
+                        # Shielded so a handover cancelling this run lets the speech play on
+                        await asyncio.shield(speeches[args[0]])
+                    finally:
+                        self.joining = None
+                    del speeches[args[0]]
+                    self.shift = max(self.shift, clock.now() - start - time)
+                else:
+                    getattr(target, command)(*args)
+                    if command == 'drive':
+                        driving = True
+                    elif command == 'halt':
+                        driving = False
+            # A trailing wait has no command of its own, but the run lasts until it is over
+            await clock.sleep_until(start + self.shift + timeline.duration)
+        finally:
+            if not self.handing_over:
+                # Interrupted mid-roll, the halt scheduled for its end never comes
+                if driving:
+                    target.halt()
+                for speech in speeches.values():
+                    speech.cancel()
+            if profiler is not None:
+                profiler.set_action(None)
+        return clock.now() - start
@@ -0,0 +1,11 @@
+import os
+
+import server_asgi
+from fleet import AsyncFleet
+
+
+# Run with `uvicorn asgi:application --port 8080` in place of uwsgi, with nginx proxy_pass-ing /api
+hosts = os.environ.get('ROBOT_HOSTS')
+# The shared secret robots listening over TCP were started with
+token = os.environ.get('ROBOT_TOKEN')
+application = server_asgi.create_app(fleet=AsyncFleet.from_file(hosts, token=token) if hosts else None)
@@ -0,0 +1,81 @@
+import asyncio
+import itertools
+import json
+
+from host import HEADER, HostError, auth_message
+
+
+class AsyncHostConnection:
+    # HostConnection for the ASGI app: same framing and request IDs, but
+    # waiting on the robot never ties up a thread
+    def __init__(self, address='/tmp/robot-control', timeout=10, token=None):
+        self.address = address
+        self.timeout = timeout
+        self.token = token
+        self.writer = None
+        self.connecting = None
+        self.pending = {}
+        self.ids = itertools.count(1)
+
+    async def connect(self):
+        if isinstance(self.address, str):
+            connection = asyncio.open_unix_connection(self.address)
+        else:
+            connection = asyncio.open_connection(*self.address)
+        reader, writer = await asyncio.wait_for(connection, self.timeout)
+        if not isinstance(self.address, str):
+            writer.write(auth_message(self.token or ''))
+        self.writer = writer
+        asyncio.ensure_future(self.receive(reader, writer))
+
+    async def receive(self, reader, writer):
+        # Responses may arrive in any order; match them to waiting callers by ID
+        try:
+            while True:
+                (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                message = json.loads((await reader.readexactly(size)).decode())
+                future = self.pending.pop(message.get('id'), None)
+                if future and not future.done():
+                    future.set_result(message)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+
+        if self.writer is writer:
+            self.writer = None
+        failed, self.pending = self.pending, {}
+        writer.close()
+        for future in failed.values():
+            if not future.done():
+                future.set_exception(HostError('Connection to robot host lost'))
+
+    async def ensure_connected(self):
+        # Concurrent first requests share one connection attempt
+        if self.writer is None:
+            if self.connecting is None:
+                self.connecting = asyncio.ensure_future(self.connect())
+            try:
+                await asyncio.shield(self.connecting)
+            finally:
+                self.connecting = None
+
+    async def request(self, command, **fields):
+        request_id = next(self.ids)
+        data = json.dumps(dict(fields, id=request_id, command=command)).encode()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await self.ensure_connected()
+            self.pending[request_id] = future
+            self.writer.write(HEADER.pack(len(data)) + data)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.pending.pop(request_id, None)
+            raise HostError('Cannot reach robot host: ' + (str(e) or 'timed out'))
+
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(request_id, None)
+            raise HostError('Robot host did not respond')
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
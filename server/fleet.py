@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asynchost import AsyncHostConnection
+from host import HostConnection, HostError
+
+
+START_LEAD = 1.0  # Seconds between dispatching a fleet RUN and every robot starting it
+
+
+class UnknownRobotError(LookupError):
+    pass
+
+
+def parse_address(address):
+    # "/tmp/robot-control" is a unix socket; "robot3.local:7070" is TCP
+    if address.startswith('/'):
+        return address
+    host, _, port = address.rpartition(':')
+    return (host, int(port))
+
+
+class Fleet:
+    # Registry of robot hosts with one persistent connection each; requests
+    # fan out in parallel, so dispatch time tracks the slowest robot rather
+    # than the sum of them
+    connection = HostConnection
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(hosts)), thread_name_prefix='fleet')
+
+    @classmethod
+    def from_file(cls, path, timeout=10, token=None):
+        # The token is only sent to robots reached over TCP
+        with open(path) as f:
+            registry = json.load(f)
+        return cls({name: cls.connection(parse_address(address), timeout=timeout, token=token)
+                    for name, address in registry.items()})
+
+    def names(self):
+        return list(self.hosts)
+
+    def request(self, names, command, **fields):
+        unknown = [name for name in names if name not in self.hosts]
+        if unknown:
+            raise UnknownRobotError(', '.join(unknown))
+        futures = {name: self.pool.submit(self.hosts[name].request, command, **fields) for name in names}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except HostError as e:
+                results[name] = {'status': 'ERROR', 'message': str(e)}
+        return results
+
+    def run(self, names, program, lead=START_LEAD):
+        # Robots start together at a wall-clock time, which assumes their clocks are NTP-synced
+        return self.request(names, 'RUN', program=program, start_at=time.time() + lead)
+
+    def stop(self, names):
+        return self.request(names, 'STOP')
+
+    def close(self):
+        for host in self.hosts.values():
+            host.close()
+        self.pool.shutdown(wait=False)
+
+
+class AsyncFleet(Fleet):
+    # The same fan-out for the ASGI app, as concurrent coroutines instead of threads
+    connection = AsyncHostConnection
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+
+    async def request(self, names, command, **fields):
+        unknown = [name for name in names if name not in self.hosts]
+        if unknown:
+            raise UnknownRobotError(', '.join(unknown))
+        replies = await asyncio.gather(*[self.hosts[name].request(command, **fields) for name in names],
+                                       return_exceptions=True)
+        results = {}
+        for name, reply in zip(names, replies):
+            if isinstance(reply, HostError):
+                results[name] = {'status': 'ERROR', 'message': str(reply)}
+            elif isinstance(reply, BaseException):
+                raise reply
+            else:
+                results[name] = reply
+        return results
+
+    def close(self):
+        for host in self.hosts.values():
+            host.close()
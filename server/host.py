@@ -0,0 +1,105 @@
+import itertools
+import json
+import socket
+import struct
+import threading
+from concurrent.futures import Future, TimeoutError
+
+
+# Must match the framing in host/protocol.py
+HEADER = struct.Struct('!I')
+
+
+class HostError(Exception):
+    pass
+
+
+def recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed by robot host')
+        data += chunk
+    return bytes(data)
+
+
+def auth_message(token):
+    # Robot hosts reached over TCP expect the shared token first; the reply
+    # comes back with ID 0, which no request uses
+    data = json.dumps({'id': 0, 'command': 'AUTH', 'token': token}).encode()
+    return HEADER.pack(len(data)) + data
+
+
+class HostConnection:
+    def __init__(self, address='/tmp/robot-control', timeout=10, token=None):
+        self.address = address
+        self.timeout = timeout
+        self.token = token
+        self.sock = None
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.ids = itertools.count(1)
+
+    def connect(self):
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        if not isinstance(self.address, str):
+            sock.sendall(auth_message(self.token or ''))
+        sock.settimeout(None)
+        self.sock = sock
+        threading.Thread(target=self.receive, args=(sock,), daemon=True).start()
+
+    def receive(self, sock):
+        # Responses may arrive in any order; match them to waiting callers by ID
+        try:
+            while True:
+                (size,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+                message = json.loads(recv_exactly(sock, size).decode())
+                with self.lock:
+                    future = self.pending.pop(message.get('id'), None)
+                if future:
+                    future.set_result(message)
+        except (OSError, ValueError):
+            pass
+
+        with self.lock:
+            if self.sock is sock:
+                self.sock = None
+            failed, self.pending = self.pending, {}
+        sock.close()
+        for future in failed.values():
+            future.set_exception(HostError('Connection to robot host lost'))
+
+    def request(self, command, **fields):
+        future = Future()
+        with self.lock:
+            request_id = next(self.ids)
+            message = dict(fields, id=request_id, command=command)
+            data = json.dumps(message).encode()
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.pending[request_id] = future
+                self.sock.sendall(HEADER.pack(len(data)) + data)
+            except OSError as e:
+                self.pending.pop(request_id, None)
+                self.sock = None
+                raise HostError('Cannot reach robot host: ' + str(e))
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise HostError('Robot host did not respond')
+
+    def close(self):
+        with self.lock:
+            if self.sock:
+                self.sock.shutdown(socket.SHUT_RDWR)
@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from host import HEADER, auth_message
+
+
+RETRY = 1.0  # Seconds between attempts to resubscribe to the robot host
+BACKLOG = 100  # Events a browser may fall behind before the oldest are dropped
+
+
+class EventRelay:
+    # One SUBSCRIBE connection to the robot host, shared by every browser
+    # watching /api/events; it is opened for the first watcher and closed
+    # after the last one leaves
+    def __init__(self, address='/tmp/robot-control', token=None):
+        self.address = address
+        self.token = token
+        self.watchers = set()
+        self.task = None
+
+    def watch(self):
+        queue = asyncio.Queue(BACKLOG)
+        self.watchers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    def unwatch(self, queue):
+        self.watchers.discard(queue)
+        if not self.watchers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while self.watchers:
+            writer = None
+            try:
+                if isinstance(self.address, str):
+                    reader, writer = await asyncio.open_unix_connection(self.address)
+                else:
+                    reader, writer = await asyncio.open_connection(*self.address)
+                    writer.write(auth_message(self.token or ''))
+                data = json.dumps({'id': 1, 'command': 'SUBSCRIBE'}).encode()
+                writer.write(HEADER.pack(len(data)) + data)
+                self.dispatch({'event': 'connected'})
+                while True:
+                    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    message = json.loads((await reader.readexactly(size)).decode())
+                    if 'event' in message:
+                        self.dispatch(message)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                if writer is not None:
+                    writer.close()
+            self.dispatch({'event': 'disconnected'})
+            await asyncio.sleep(RETRY)
+
+    def dispatch(self, message):
+        # Encoded once, however many browsers are watching
+        data = json.dumps(message).encode()
+        for queue in self.watchers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((message['event'], data))
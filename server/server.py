@@ -1,47 +1,164 @@
-import os
 import json
-import socket
 
 import falcon
 
+from fleet import Fleet, UnknownRobotError
+from host import HostConnection, HostError
+from slots import SlotStore, EncodingError, accepted_encodings, decode_body
+
+
+# Request handling shared with server_asgi.py, whose resources differ only in
+# awaiting the host and the fleet
+
+def slot_response(req, resp, store, slot_id):
+    encodings = accepted_encodings(req.get_header('Accept-Encoding'))
+    data, encoding, etag = store.get(slot_id, encodings)
+    if data is None:
+        raise falcon.HTTPNotFound()
+
+    resp.etag = etag
+    resp.vary = ('Accept-Encoding',)
+    if req.if_none_match and (etag in req.if_none_match or '*' in req.if_none_match):
+        resp.status = falcon.HTTP_NOT_MODIFIED
+        return
+    resp.content_type = falcon.MEDIA_JSON
+    if encoding:
+        resp.set_header('Content-Encoding', encoding)
+    resp.data = data
+
+def parse_slot(req, body, store, slot_id):
+    try:
+        body = decode_body(body, req.get_header('Content-Encoding'))
+    except EncodingError as e:
+        raise falcon.HTTPBadRequest(description=str(e))
+    try:
+        slot = json.loads(body.decode())
+    except ValueError:
+        raise falcon.HTTPBadRequest(description='Slot is not valid JSON')
+    if slot_id not in store.index:
+        raise falcon.HTTPNotFound()
+    if not isinstance(slot, dict) or 'name' not in slot:
+        raise falcon.HTTPBadRequest(description='Slot must have a name')
+    return slot
+
+def slot_saved(resp, slot_id, entry):
+    resp.etag = entry['etag']
+    resp.media = dict(entry, id=slot_id)
+
+def host_request(host, data):
+    # The request to the host for a POST to /api/program; awaitable from an AsyncHostConnection
+    if data.get('stop'):
+        return host.request('STOP')
+    return host.request('RUN', program=program_field(data), dry_run=bool(data.get('dry_run')),
+                        reload=bool(data.get('reload')))
+
+def fleet_request(fleet, data):
+    # "robots" is a list of registry names or "all"; each robot reports its own result
+    robots = data['robots']
+    if robots == 'all':
+        names = fleet.names()
+    elif isinstance(robots, list) and all(isinstance(name, str) for name in robots):
+        names = robots
+    else:
+        raise falcon.HTTPBadRequest(description='Robots must be a list of names or "all"')
+    if data.get('stop'):
+        return fleet.stop(names)
+    return fleet.run(names, program_field(data))
+
+def program_field(data):
+    program = data.get('program')
+    if not isinstance(program, str):
+        raise falcon.HTTPBadRequest(description='A program is required')
+    return program
+
+def program_result(result):
+    if result['status'] == 'ERROR':
+        raise falcon.HTTPBadRequest(title='Program error', description=result.get('message'))
+    return result
+
+def stats_fields(body):
+    # {"enable": true|false, "reset": true} switches instrumentation on the host
+    data = json.loads(body.decode() or '{}')
+    return {key: bool(data[key]) for key in ('enable', 'reset') if key in data}
+
+def host_unavailable(error):
+    return falcon.HTTPServiceUnavailable(description=str(error))
+
+def unknown_robot(error):
+    return falcon.HTTPNotFound(description='No such robot: ' + error.args[0])
+
 
 class SlotsResource:
+    def __init__(self, store):
+        self.store = store
+
     def on_get(self, req, resp):
-        if not os.path.exists('/home/pi/data/slots'):
-            with open('/home/pi/data/slots', 'w') as f:
-                json.dump([
-                    {'name': 'Slot 1', 'data': ''},
-                    {'name': 'Slot 2', 'data': ''},
-                    {'name': 'Slot 3', 'data': ''},
-                    {'name': 'Slot 4', 'data': ''},
-                    {'name': 'Slot 5', 'data': ''},
-                    ], f)
-        resp.stream = open('/home/pi/data/slots')
-    
-    def on_post(self, req, resp):
-        with open('/home/pi/data/slots', 'w') as f:
-            f.write(req.stream.read().decode())
+        resp.media = self.store.list()
+
+class SlotResource:
+    def __init__(self, store):
+        self.store = store
+
+    def on_get(self, req, resp, slot_id):
+        slot_response(req, resp, self.store, slot_id)
+
+    def on_put(self, req, resp, slot_id):
+        slot = parse_slot(req, req.bounded_stream.read(), self.store, slot_id)
+        slot_saved(resp, slot_id, self.store.put(slot_id, slot))
 
 class ProgramResource:
-    def on_post(self, req, resp):
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.connect('/tmp/robot-control')
+    def __init__(self, host, fleet):
+        self.host = host
+        self.fleet = fleet
 
-        data = json.loads(req.stream.read().decode())
-        if data.get('stop'):
-            sock.send('STOP\n'.encode())
+    def on_post(self, req, resp):
+        data = json.loads(req.bounded_stream.read().decode())
+        if data.get('robots') is not None:
+            try:
+                resp.media = {'robots': fleet_request(self.fleet, data)}
+            except UnknownRobotError as e:
+                raise unknown_robot(e)
             return
+        try:
+            result = host_request(self.host, data)
+        except HostError as e:
+            raise host_unavailable(e)
+        resp.media = program_result(result)
+
+class RobotsResource:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def on_get(self, req, resp):
+        resp.media = self.fleet.names()
+
+class StatsResource:
+    def __init__(self, host):
+        self.host = host
+
+    def on_get(self, req, resp):
+        resp.media = self.request()
+
+    def on_post(self, req, resp):
+        resp.media = self.request(**stats_fields(req.bounded_stream.read()))
 
-        program = data['program'].encode()
-        sock.send('RUN\n'.encode())
-        sock.send((str(len(program)) + '\n').encode())
-        sock.send(program)
-        sock.close()
+    def request(self, **fields):
+        try:
+            result = self.host.request('STATS', **fields)
+        except HostError as e:
+            raise host_unavailable(e)
+        return result['stats']
 
-def create_app():
+def create_app(host=None, slots=None, fleet=None):
     app = falcon.App()
+    host = host or HostConnection()
+    fleet = fleet or Fleet({'local': host})
+    slots = slots or SlotStore('/home/pi/data/slots.d', legacy_file='/home/pi/data/slots')
     
-    app.add_route('/api/slots', SlotsResource())
-    app.add_route('/api/program', ProgramResource())
+    app.add_route('/api/slots', SlotsResource(slots))
+    app.add_route('/api/slots/{slot_id:int}', SlotResource(slots))
+    app.add_route('/api/program', ProgramResource(host, fleet))
+    app.add_route('/api/robots', RobotsResource(fleet))
+    app.add_route('/api/stats', StatsResource(host))
 
     return app
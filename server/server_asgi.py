@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import falcon
+import falcon.asgi
+
+from asynchost import AsyncHostConnection
+from relay import EventRelay
+from fleet import AsyncFleet, UnknownRobotError
+from host import HostError
+from server import (slot_response, parse_slot, slot_saved, host_request, fleet_request, program_result,
+                    stats_fields, host_unavailable, unknown_robot)
+from slots import SlotStore
+
+
+# The resources of server.py for falcon.asgi: host requests are awaited on the
+# event loop and slot writes run in a thread, so a slow robot or a large slot
+# holds up only its own request. Only this build serves /api/events, as each
+# open event stream would hold one of the WSGI build's three threads
+
+class SlotsResource:
+    def __init__(self, store):
+        self.store = store
+
+    async def on_get(self, req, resp):
+        resp.media = self.store.list()
+
+class SlotResource:
+    def __init__(self, store):
+        self.store = store
+
+    async def on_get(self, req, resp, slot_id):
+        slot_response(req, resp, self.store, slot_id)
+
+    async def on_put(self, req, resp, slot_id):
+        slot = parse_slot(req, await req.bounded_stream.read(), self.store, slot_id)
+        slot_saved(resp, slot_id, await asyncio.to_thread(self.store.put, slot_id, slot))
+
+class ProgramResource:
+    def __init__(self, host, fleet):
+        self.host = host
+        self.fleet = fleet
+
+    async def on_post(self, req, resp):
+        data = json.loads((await req.bounded_stream.read()).decode())
+        if data.get('robots') is not None:
+            try:
+                resp.media = {'robots': await fleet_request(self.fleet, data)}
+            except UnknownRobotError as e:
+                raise unknown_robot(e)
+            return
+        try:
+            result = await host_request(self.host, data)
+        except HostError as e:
+            raise host_unavailable(e)
+        resp.media = program_result(result)
+
+class RobotsResource:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    async def on_get(self, req, resp):
+        resp.media = self.fleet.names()
+
+class StatsResource:
+    def __init__(self, host):
+        self.host = host
+
+    async def on_get(self, req, resp):
+        resp.media = await self.request()
+
+    async def on_post(self, req, resp):
+        resp.media = await self.request(**stats_fields(await req.bounded_stream.read()))
+
+    async def request(self, **fields):
+        try:
+            result = await self.host.request('STATS', **fields)
+        except HostError as e:
+            raise host_unavailable(e)
+        return result['stats']
+
+class EventsResource:
+    KEEPALIVE = 15.0
+
+    def __init__(self, relay):
+        self.relay = relay
+
+    async def on_get(self, req, resp):
+        queue = self.relay.watch()
+
+        async def events():
+            try:
+                while True:
+                    try:
+                        event, data = await asyncio.wait_for(queue.get(), self.KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield None  # A comment line, so proxies keep the stream open
+                    else:
+                        yield falcon.asgi.SSEvent(data=data, event=event)
+            finally:
+                self.relay.unwatch(queue)
+
+        resp.sse = events()
+
+def create_app(host=None, slots=None, fleet=None, relay=None):
+    app = falcon.asgi.App()
+    host = host or AsyncHostConnection()
+    relay = relay or EventRelay(host.address, token=host.token)
+    fleet = fleet or AsyncFleet({'local': host})
+    slots = slots or SlotStore('/home/pi/data/slots.d', legacy_file='/home/pi/data/slots')
+
+    app.add_route('/api/slots', SlotsResource(slots))
+    app.add_route('/api/slots/{slot_id:int}', SlotResource(slots))
+    app.add_route('/api/program', ProgramResource(host, fleet))
+    app.add_route('/api/robots', RobotsResource(fleet))
+    app.add_route('/api/stats', StatsResource(host))
+    app.add_route('/api/events', EventsResource(relay))
+
+    return app
@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+DEFAULT_SLOTS = [{'name': 'Slot %d' % n, 'data': ''} for n in range(1, 6)]
+
+MAX_SLOT_SIZE = 16 * 1024 * 1024
+DECODE_CHUNK = 1024 * 1024
+
+
+class EncodingError(ValueError):
+    pass
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+def brotli_decompress(data):
+    # A few hundred bytes of brotli can expand to gigabytes, so the output is
+    # taken a chunk at a time and given up on as soon as it is too large
+    decompressor = brotli.Decompressor()
+    chunks = []
+    size = 0
+    try:
+        chunk = decompressor.process(data, output_buffer_limit=DECODE_CHUNK)
+        while chunk:
+            size += len(chunk)
+            if size > MAX_SLOT_SIZE:
+                raise EncodingError('Slot is too large')
+            chunks.append(chunk)
+            if decompressor.is_finished():
+                break
+            chunk = decompressor.process(b'', output_buffer_limit=DECODE_CHUNK)
+    except brotli.error as e:
+        raise EncodingError('Invalid brotli body: ' + str(e))
+    if not decompressor.is_finished():
+        raise EncodingError('Invalid brotli body: truncated')
+    return b''.join(chunks)
+
+
+def decode_body(data, encoding):
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        decoded = data
+    elif encoding in ('gzip', 'x-gzip'):
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            decoded = decompressor.decompress(data, MAX_SLOT_SIZE)
+        except zlib.error as e:
+            raise EncodingError('Invalid gzip body: ' + str(e))
+        if decompressor.unconsumed_tail:
+            raise EncodingError('Slot is too large')
+    elif encoding == 'br' and brotli is not None:
+        decoded = brotli_decompress(data)
+    else:
+        raise EncodingError('Unsupported content encoding: ' + encoding)
+
+    if len(decoded) > MAX_SLOT_SIZE:
+        raise EncodingError('Slot is too large')
+    return decoded
+
+
+def compress(encoded, gzipped=None):
+    blobs = {'gzip': gzipped or gzip.compress(encoded, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        blobs['br'] = brotli.compress(encoded, mode=brotli.MODE_TEXT)
+    return blobs
+
+
+class SlotStore:
+    def __init__(self, directory, legacy_file=None):
+        self.directory = directory
+        # Serializes writers only. Readers never wait for a disk write, which
+        # would stall the ASGI event loop: each slot's entry and bodies are
+        # published together as one tuple once written
+        self.lock = threading.Lock()
+
+        # slot id -> {'name', 'size', 'etag'}, plus the precompressed bodies
+        # served for each slot: slot id -> (entry, {'gzip': ..., 'br': ...})
+        self.index = {}
+        self.slots = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self.load(legacy_file)
+
+    def path(self, slot_id):
+        return os.path.join(self.directory, '%d.json.gz' % slot_id)
+
+    def load(self, legacy_file):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            match = re.fullmatch(r'(\d+)\.json(\.gz)?', name)
+            if match and match.group(2):
+                with open(path, 'rb') as f:
+                    compressed = f.read()
+                encoded = gzip.decompress(compressed)
+                self.add(int(match.group(1)), encoded, compress(encoded, compressed))
+            elif match:
+                # Uncompressed slot from an earlier version of the store
+                with open(path, 'rb') as f:
+                    self.put(int(match.group(1)), json.loads(f.read().decode()))
+                os.remove(path)
+            elif name.endswith('.tmp'):
+                os.remove(path)
+
+        if not self.index:
+            # First start: split up the old single-file store, if there is one
+            try:
+                with open(legacy_file) as f:
+                    slots = json.load(f)
+            except (TypeError, OSError, ValueError):
+                slots = DEFAULT_SLOTS
+            for slot_id, slot in enumerate(slots, 1):
+                self.put(slot_id, slot)
+
+    def add(self, slot_id, encoded, blobs):
+        slot = json.loads(encoded.decode())
+        entry = {
+            'name': slot['name'],
+            'size': len(encoded),
+            'compressed': len(blobs['gzip']),
+            'etag': hashlib.sha1(encoded).hexdigest(),
+        }
+        self.slots[slot_id] = (entry, blobs)
+        self.index[slot_id] = entry
+        return entry
+
+    def list(self):
+        return [dict(entry, id=slot_id) for slot_id, entry in sorted(self.index.items())]
+
+    def get(self, slot_id, encodings=()):
+        entry, blobs = self.slots.get(slot_id, (None, None))
+        if entry is None:
+            return None, None, None
+
+        for encoding in ('br', 'gzip'):
+            if encoding in encodings and encoding in blobs:
+                return blobs[encoding], encoding, entry['etag'] + '-' + encoding
+        return gzip.decompress(blobs['gzip']), None, entry['etag']
+
+    def put(self, slot_id, slot):
+        encoded = json.dumps({'name': str(slot['name']), 'data': str(slot.get('data', ''))}).encode()
+        blobs = compress(encoded)
+        with self.lock:
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blobs['gzip'])
+            os.replace(temp, self.path(slot_id))
+            return self.add(slot_id, encoded, blobs)
@@ -1,6 +1,11 @@
 import os
 
 import server
+from fleet import Fleet
 
 
-application = server.create_app()
+# A JSON file of {"name": "/unix/socket" or "host:port"} for driving several robots
+hosts = os.environ.get('ROBOT_HOSTS')
+# The shared secret robots listening over TCP were started with
+token = os.environ.get('ROBOT_TOKEN')
+application = server.create_app(fleet=Fleet.from_file(hosts, token=token) if hosts else None)
@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import common
+from host import HostConnection
+
+
+PROGRAM = """
+@robot.when_started
+def arms():
+    robot.move_arm('left', 45)
+    robot.wait(%s)
+    robot.move_arm('left', 0)
+
+@robot.when_started
+def wheels():
+    robot.wait(1)
+    robot.roll('forward', 1)
+"""
+
+
+def test_stop_after_reload_leaves_no_hardware_writes():
+    with common.SimulatedHost() as sim:
+        host = HostConnection(sim.socket)
+        assert host.request('RUN', program=PROGRAM % 2)['status'] == 'OK'
+        time.sleep(0.2)
+        reply = host.request('RUN', program=PROGRAM % 3, reload=True)
+        assert reply['status'] == 'OK' and reply['changed'] == 1
+        time.sleep(0.2)
+        assert host.request('STOP')['status'] == 'OK'
+        mark = len(sim.backend.log)
+        # Past when the untouched handler would have started rolling
+        time.sleep(1.5)
+        assert sim.backend.log[mark:] == []
+        host.close()